@@ -0,0 +1,242 @@
+# benchmark.py
+# Reproducible performance benchmarks for PhoneBookService, no interactive menu.
+#
+#   python benchmark.py                          # 10k, 100k and 1M contacts
+#   python benchmark.py --sizes 10000 --out bench.json
+#   python benchmark.py --sizes 10000 --compare old.json
+#
+# Every run generates a synthetic phonebook from a fixed seed in a temporary
+# directory and writes machine-readable JSON results. Reads are timed with the
+# result cache off; the "[cached]" rows time the same reads as cache hits.
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import unicodedata
+from datetime import datetime
+
+from models import format_timestamp, parse_timestamp
+from services import PhoneBookService, SORT_MODES
+from storage import CONTACT_FILE_NAME, GROUP_FILE_NAME, RELATION_FILE_NAME
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+
+# --- SYNTHETIC DATA ---
+FAMILY_NAMES = ["Nguyễn", "Trần", "Lê", "Phạm", "Hoàng", "Huỳnh", "Phan", "Vũ", "Võ", "Đặng",
+                "Bùi", "Đỗ", "Hồ", "Ngô", "Dương", "Lý"]
+MIDDLE_NAMES = ["Văn", "Thị", "Hữu", "Minh", "Ngọc", "Thanh", "Đức", "Quốc", "Thu", "Gia", ""]
+GIVEN_NAMES = ["An", "Bình", "Châu", "Dũng", "Giang", "Hà", "Hải", "Hạnh", "Hiếu", "Hoa", "Hùng",
+               "Khang", "Lan", "Linh", "Long", "Mai", "Nam", "Nga", "Phong", "Phúc", "Quân", "Sơn",
+               "Tâm", "Thảo", "Trang", "Trung", "Tú", "Tùng", "Uyên", "Vy", "Yến"]
+CITIES = ["hcm", "hn", "đn", "hp", "ct", "huế", "nt", "vt", ""]
+MAIL_DOMAINS = ["gmail.com", "yahoo.com", "outlook.com", "ut.edu.vn", "fpt.vn"]
+NOTES = ["", "", "", "khách hàng", "đồng nghiệp", "gia đình", "vip"]
+GROUP_NAMES = ["Gia đình", "Bạn bè", "Đồng nghiệp", "Khách hàng", "Đối tác", "Lớp", "CLB"]
+
+
+def ascii_fold(text):
+    return unicodedata.normalize("NFKD", text.replace("đ", "d").replace("Đ", "D")).encode("ascii", "ignore").decode()
+
+
+def random_contact(rng, c_id, start_ts, span):
+    middle = rng.choice(MIDDLE_NAMES)
+    name = " ".join(p for p in (rng.choice(FAMILY_NAMES), middle, rng.choice(GIVEN_NAMES)) if p)
+    # Unique phone per id, spread over the 09x prefixes
+    phone = "09%08d" % ((c_id * 7919) % 100000000)
+    email = ""
+    if rng.random() < 0.7:
+        email = ascii_fold(name.lower()).replace(" ", ".") + str(c_id) + "@" + rng.choice(MAIL_DOMAINS)
+    fav = rng.random() < 0.1
+    created = format_timestamp(start_ts + rng.randrange(span))
+    return f"{c_id}|{name}|{phone}|{email}|{rng.choice(CITIES)}|{rng.choice(NOTES)}|{fav}|{created}\n"
+
+
+def generate_phonebook(data_dir, n_contacts, seed=42):
+    # Writes contacts.txt, groups.txt and contact_group.txt; -> (n_groups, n_relations)
+    rng = random.Random(seed)
+    start_ts = parse_timestamp("2024-01-01 00:00:00")
+    span = 2 * 365 * 24 * 3600
+    with open(os.path.join(data_dir, CONTACT_FILE_NAME), "w", encoding="utf-8") as f:
+        for c_id in range(1, n_contacts + 1):
+            f.write(random_contact(rng, c_id, start_ts, span))
+
+    n_groups = max(5, n_contacts // 1000)
+    with open(os.path.join(data_dir, GROUP_FILE_NAME), "w", encoding="utf-8") as f:
+        for g_id in range(1, n_groups + 1):
+            f.write(f"{g_id}|{rng.choice(GROUP_NAMES)} {g_id}|nhóm số {g_id}\n")
+
+    # Most contacts are in 0-2 groups; group sizes are skewed towards the first groups
+    n_relations = 0
+    with open(os.path.join(data_dir, RELATION_FILE_NAME), "w", encoding="utf-8") as f:
+        for c_id in range(1, n_contacts + 1):
+            for g_id in {min(n_groups, int(rng.paretovariate(1.2))) for _ in range(rng.choice((0, 1, 1, 2)))}:
+                f.write(f"{c_id}|{g_id}\n")
+                n_relations += 1
+    return n_groups, n_relations
+
+
+def generate_import_file(path, n_rows, first_id, seed=7, duplicate_ratio=0.1):
+    # Import rows with the export header; some phones repeat earlier rows
+    rng = random.Random(seed)
+    start_ts = parse_timestamp("2024-01-01 00:00:00")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("ID|FullName|Phone|Email|Address|Note|Favorite|CreatedAt\n")
+        for i in range(n_rows):
+            c_id = first_id + i
+            if i and rng.random() < duplicate_ratio:
+                c_id = first_id + rng.randrange(i)
+            f.write(random_contact(rng, c_id, start_ts, 3600))
+
+
+# --- TIMING ---
+def timed(fn, repeat=1):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - started)
+    return {"runs": repeat, "min_s": min(samples), "median_s": statistics.median(samples),
+            "mean_s": statistics.fmean(samples)}, result
+
+
+def per_op(stats, ops):
+    stats = dict(stats)
+    stats["ops"] = ops
+    stats["ops_per_s"] = ops / stats["median_s"] if stats["median_s"] else None
+    return stats
+
+
+def run_size(n, seed, repeat, log):
+    results = {}
+    rng = random.Random(seed + 1)
+    with tempfile.TemporaryDirectory(prefix=f"phonebook_bench_{n}_") as data_dir:
+        log(f"[{n}] generating data")
+        n_groups, n_relations = generate_phonebook(data_dir, n, seed)
+        results["dataset"] = {"contacts": n, "groups": n_groups, "relations": n_relations}
+
+        snapshot = os.path.join(data_dir, "phonebook.snap")
+        # Without the result cache: every repeat of a read does the work again
+        # instead of timing a cache hit. Cached reads get their own rows below
+        def cold_load():
+            if os.path.exists(snapshot): os.remove(snapshot)
+            return PhoneBookService(data_dir, cache_size=0)
+        log(f"[{n}] load_system_data")
+        results["load_text"], _ = timed(cold_load, repeat)
+        results["load_snapshot"], service = timed(lambda: PhoneBookService(data_dir, cache_size=0), repeat)
+        results["save_system_data"], _ = timed(lambda: service.save_system_data(full=True), repeat)
+
+        log(f"[{n}] search_contact")
+        results["search_index_build"], _ = timed(lambda: service.search_contact("nguyen"))
+        queries = [rng.choice(GIVEN_NAMES).lower() for _ in range(50)] + \
+                  ["09%04d" % rng.randrange(10000) for _ in range(30)] + \
+                  [rng.choice(MAIL_DOMAINS) for _ in range(10)] + ["ng", "a", "zzzq", "văn an"] * 2 + ["x"]
+        stats, _ = timed(lambda: [service.search_contact(q) for q in queries], repeat)
+        results["search_contact"] = per_op(stats, len(queries))
+
+        log(f"[{n}] get_all_contacts")
+        for mode in SORT_MODES:
+            service.get_all_contacts(mode)  # builds the ordering once
+            results[f"get_all_contacts[{mode}]"], _ = timed(lambda: service.get_all_contacts(mode), repeat)
+        stats, _ = timed(lambda: [service.get_contacts_page("name_desc", off, 20) for off in range(0, n, max(1, n // 100))], repeat)
+        results["get_contacts_page"] = per_op(stats, len(range(0, n, max(1, n // 100))))
+
+        group_ids = [rng.randint(1, n_groups) for _ in range(100)]
+        stats, _ = timed(lambda: [service.get_contacts_in_group(g) for g in group_ids], repeat)
+        results["get_contacts_in_group"] = per_op(stats, len(group_ids))
+
+        log(f"[{n}] add_contact")
+        # Default mode rewrites the data files on every call; journal mode appends one record
+        k = 3 if n >= 1000000 else 10
+        stats, _ = timed(lambda: [service.add_contact("Bench Save", f"08{n}{i:06d}", "", "", "") for i in range(k)])
+        results["add_contact[full_save]"] = per_op(stats, k)
+        journaled = PhoneBookService(data_dir, use_journal=True, journal_limit=10 ** 9)
+        stats, _ = timed(lambda: [journaled.add_contact("Bench Journal", f"07{n}{i:06d}", "", "", "") for i in range(1000)])
+        results["add_contact[journal]"] = per_op(stats, 1000)
+        journaled.compact_journal()
+
+        log(f"[{n}] cached reads")
+        # The same reads answered from the result cache: one run fills it, the timed runs hit it
+        cached = PhoneBookService(data_dir)
+        for q in queries: cached.search_contact(q)
+        stats, _ = timed(lambda: [cached.search_contact(q) for q in queries], repeat)
+        results["search_contact[cached]"] = per_op(stats, len(queries))
+        cached.get_all_contacts("name_asc")
+        results["get_all_contacts[name_asc,cached]"], _ = timed(lambda: cached.get_all_contacts("name_asc"), repeat)
+        for g in group_ids: cached.get_contacts_in_group(g)
+        stats, _ = timed(lambda: [cached.get_contacts_in_group(g) for g in group_ids], repeat)
+        results["get_contacts_in_group[cached]"] = per_op(stats, len(group_ids))
+        cached.storage.close()
+        del cached
+
+        log(f"[{n}] import / export")
+        import_rows = max(1000, n // 10)
+        import_path = os.path.join(data_dir, "import.txt")
+        generate_import_file(import_path, import_rows, first_id=n * 10, seed=seed)
+        service = PhoneBookService(data_dir)
+        stats, (ok, msg) = timed(lambda: service.import_contacts_from_file(import_path))
+        results["import_contacts_from_file"] = per_op(stats, import_rows)
+        results["import_contacts_from_file"]["message"] = msg
+
+        for name in ("export.txt", "export.csv", "export.jsonl.gz"):
+            path = os.path.join(data_dir, name)
+            stats, _ = timed(lambda: service.export_contacts_to_file(path), repeat)
+            results[f"export[{name.split('.', 1)[1]}]"] = per_op(stats, len(service.contacts))
+        service.storage.close()
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(current, baseline_path):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\n{'size':>8} | {'operation':<34} | {'baseline':>10} | {'current':>10} | ratio")
+    print("-" * 80)
+    for size, ops in current["results"].items():
+        old_ops = baseline.get("results", {}).get(size, {})
+        for op, stats in ops.items():
+            old = old_ops.get(op)
+            if not isinstance(stats, dict) or "median_s" not in stats or not old: continue
+            ratio = stats["median_s"] / old["median_s"] if old["median_s"] else float("inf")
+            flag = "  <-- slower" if ratio > 1.2 else ""
+            print(f"{size:>8} | {op:<34} | {old['median_s']:>9.4f}s | {stats['median_s']:>9.4f}s | {ratio:5.2f}x{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PhoneBookService benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="contact counts to benchmark")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per timed operation (median is reported)")
+    parser.add_argument("--out", default="bench_output.json", help="where to write the JSON results")
+    parser.add_argument("--compare", metavar="BASELINE_JSON", help="print ratios against an earlier result file")
+    args = parser.parse_args(argv)
+
+    log = lambda msg: print(msg, file=sys.stderr, flush=True)
+    report = {"meta": {"started_at": datetime.now().isoformat(timespec="seconds"), "git_revision": git_revision(),
+                       "python": platform.python_version(), "platform": platform.platform(),
+                       "seed": args.seed, "repeat": args.repeat},
+              "results": {}}
+    for n in args.sizes:
+        report["results"][str(n)] = run_size(n, args.seed, args.repeat, log)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    log(f"Results written to {args.out}")
+    if args.compare: compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# cache.py
+# Bounded LRU cache for read results. Entries belong to one data version: the
+# service bumps its version on every change, and the first lookup with a newer
+# version drops everything cached before, so a stale result is never served.
+import sys
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    def __init__(self, max_entries=256, max_bytes=64 << 20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # key -> (value, size), least recently used first
+        self._entries = OrderedDict()
+        self._version = None
+        self._bytes = 0
+        # Readers share the service lock, so they can reach the cache together
+        self._mutex = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, version):
+        # -> cached value or None
+        with self._mutex:
+            if version != self._version: self._reset(version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, version, value):
+        # value: a tuple of records shared with the service, so only the tuple is counted
+        size = sys.getsizeof(value)
+        with self._mutex:
+            if version != self._version: self._reset(version)
+            if size > self.max_bytes: return
+            old = self._entries.pop(key, None)
+            if old: self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, old_size) = self._entries.popitem(last=False)
+                self._bytes -= old_size
+                self.evictions += 1
+
+    def _reset(self, version):
+        if self._entries: self.invalidations += 1
+        self._entries.clear()
+        self._bytes = 0
+        self._version = version
+
+    def clear(self):
+        with self._mutex:
+            self._entries.clear()
+            self._bytes = 0
+
+    def info(self):
+        with self._mutex:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "bytes": self._bytes,
+                    "evictions": self.evictions, "invalidations": self.invalidations,
+                    "max_entries": self.max_entries, "max_bytes": self.max_bytes}
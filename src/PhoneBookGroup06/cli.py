@@ -0,0 +1,265 @@
+# cli.py
+# One-shot commands for scripts, run through main.py:
+#
+#   python main.py lookup 0912345678
+#   python main.py search tran --limit 20
+#   python main.py export backup.csv --group 3
+#   python main.py import new_contacts.txt
+#   python main.py batch < requests.txt
+#
+# lookup and search are answered from the binary snapshot (snapshot.py) when it is
+# current, reading only the columns they need, or from the SQLite tables with
+# PHONEBOOK_BACKEND=sqlite. Anything else, or a missing/stale snapshot, loads the
+# full service. batch reads one command per line from stdin and answers each with
+# one JSON line, {"ok": true, "result": ...} or {"ok": false, "error": "Error: ..."},
+# so thousands of requests share one start-up.
+import argparse
+import contextlib
+import json
+import os
+import shlex
+import sys
+
+from models import Contact, canonical_phone, query_key, search_fields, contact_dict
+from indexes import NGramIndex
+from storage import DATA_DIR, SQLITE_FILE_NAME, SqliteBackend, open_backend, open_snapshot, data_signature
+
+# batch: snapshot searches scan every contact; after this many, building the
+# n-gram index once (about as long as that many scans) makes the rest cheaper
+SEARCH_SCANS_BEFORE_INDEX = 100
+
+
+def open_service(data_dir=DATA_DIR, watch=False):
+    # The full service, set up from the PHONEBOOK_* variables (see main.py).
+    # services is imported here: it pulls in multiprocessing, csv and gzip, which
+    # lookups answered from the snapshot never need
+    from services import PhoneBookService
+    service = PhoneBookService(storage=open_backend(os.environ.get("PHONEBOOK_BACKEND", "text"), data_dir,
+                                                    use_journal=os.environ.get("PHONEBOOK_JOURNAL") == "1"),
+                               instrument=os.environ.get("PHONEBOOK_STATS") == "1",
+                               write_behind=os.environ.get("PHONEBOOK_WRITE_BEHIND") == "1")
+    if watch: service.watch()
+    return service
+
+
+class CommandError(Exception):
+    pass
+
+
+class _Parser(argparse.ArgumentParser):
+    # Bad arguments end only the current command, so a batch carries on
+    def error(self, message):
+        raise CommandError(f"Error: {message}.")
+
+
+class Session:
+    # What the commands read from, opened on first use and kept for the next commands
+    def __init__(self, data_dir=DATA_DIR):
+        self.data_dir = data_dir
+        self.service = None
+        self._sqlite = None
+        self._reader = None
+        self._reader_signature = None
+        # Snapshot lookups: phone key -> row, built on the second lookup
+        self._phone_rows = None
+        self._lookups = 0
+        # Snapshot searches: search_fields() of every row, contact ids, and the
+        # n-gram index over them once enough searches were made
+        self._fields = None
+        self._ids = None
+        self._index = None
+        self._scans = 0
+
+    def close(self):
+        self._close_reader()
+        if self._sqlite is not None: self._sqlite.close()
+        # Write-behind mode: changes not saved yet are written here
+        if self.service is not None: self.service.close()
+
+    def _close_reader(self):
+        if self._reader is not None: self._reader.close()
+        self._reader = None
+        self._phone_rows = self._fields = self._ids = self._index = None
+        self._lookups = self._scans = 0
+
+    def get_service(self):
+        if self.service is None:
+            # From here on the service answers everything: it sees its own changes
+            self._close_reader()
+            self.service = open_service(self.data_dir)
+        return self.service
+
+    def snapshot(self):
+        # A SnapshotReader holding the current data, or None
+        if self.service is not None or os.environ.get("PHONEBOOK_BACKEND") == "sqlite": return None
+        signature = data_signature(self.data_dir)
+        if self._reader is not None and signature == self._reader_signature: return self._reader
+        # Another program changed the data since the reader was opened
+        self._close_reader()
+        self._reader = open_snapshot(self.data_dir)
+        self._reader_signature = signature
+        return self._reader
+
+    def sqlite(self):
+        if self.service is not None or os.environ.get("PHONEBOOK_BACKEND") != "sqlite": return None
+        path = os.path.join(self.data_dir, SQLITE_FILE_NAME)
+        # A new database is filled from the text files by open_backend(), via the service
+        if self._sqlite is None and os.path.exists(path): self._sqlite = SqliteBackend(path)
+        return self._sqlite
+
+    # --- COMMANDS ---
+    def lookup(self, phone):
+        key = canonical_phone(phone)
+        reader = self.snapshot() if key else None
+        if reader is not None:
+            row = self._phone_row(reader, key)
+            c = None if row is None else reader.contact_at(row)
+        elif self.sqlite() is not None:
+            c = self._sqlite.find_contact_by_phone(phone)
+        else:
+            c = self.get_service().get_contact_by_phone(phone)
+        if c is None: raise CommandError("Error: Contact not found.")
+        return c
+
+    def _phone_row(self, reader, key):
+        # One lookup searches the key column's bytes; for more, a dict of the column is cheaper.
+        # The first row (smallest id) with the key wins, like the service's phone index
+        self._lookups += 1
+        if self._phone_rows is None and self._lookups > 1:
+            keys = reader.contact_column("phone_key")
+            self._phone_rows = dict(zip(reversed(keys), range(len(keys) - 1, -1, -1)))
+        if self._phone_rows is not None: return self._phone_rows.get(key)
+        rows = reader.find("phone_key", key, whole=True)
+        return rows[0] if rows else None
+
+    def search(self, keyword, limit=None):
+        # Same matches, in the same (id) order, as PhoneBookService.search_contact()
+        reader = self.snapshot()
+        if reader is not None:
+            rows = self._search_rows(reader, query_key(keyword))
+            rows.sort(key=self._ids.__getitem__)
+            return reader.contacts_at(rows[:limit])
+        if self.sqlite() is not None:
+            return self._sqlite.search_contacts(keyword)[:limit]
+        return self.get_service().search_contact(keyword, limit)
+
+    def _search_rows(self, reader, text):
+        if self._fields is None:
+            names, phones, emails = [reader.contact_column(name) for name in ("full_name", "phone_number", "email")]
+            self._fields = list(map(search_fields, names, phones, emails))
+            self._ids = reader.contact_column("contact_id")
+        if self._index is None and self._scans >= SEARCH_SCANS_BEFORE_INDEX:
+            self._index = NGramIndex()
+            self._index.build(enumerate(self._fields))
+        if self._index is not None: return self._index.search(text)
+        self._scans += 1
+        return [i for i, fields in enumerate(self._fields) if text in fields[0] or text in fields[1] or text in fields[2]]
+
+    def export(self, path, group_id=None, favorites_only=False, fmt=None):
+        ok, msg = self.get_service().export_contacts_to_file(path, fmt, favorites_only=favorites_only, group_id=group_id)
+        if not ok: raise CommandError(msg)
+        return msg
+
+    def import_file(self, path):
+        ok, msg = self.get_service().import_contacts_from_file(path)
+        if not ok: raise CommandError(msg)
+        return msg
+
+
+def build_parser():
+    parser = _Parser(prog="main.py", description="PhoneBook commands; without one the menu starts")
+    parser.add_argument("--data", default=DATA_DIR, help="data folder")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    # --json also after the command; SUPPRESS keeps a --json given before it
+    output = _Parser(add_help=False)
+    output.add_argument("--json", action="store_true", default=argparse.SUPPRESS, help="print results as JSON")
+    commands = parser.add_subparsers(dest="command")
+    p = commands.add_parser("lookup", parents=[output], help="contact with this phone number, in any format")
+    p.add_argument("phone")
+    p = commands.add_parser("search", parents=[output], help="contacts whose name, phone or email contains the keyword")
+    p.add_argument("keyword")
+    p.add_argument("--limit", type=int)
+    p = commands.add_parser("export", parents=[output], help="write contacts to a .txt/.csv/.jsonl file (.gz compresses)")
+    p.add_argument("path")
+    p.add_argument("--group", type=int, help="only this group's members")
+    p.add_argument("--favorites", action="store_true", help="only favorites")
+    p.add_argument("--format", choices=("txt", "csv", "jsonl"), help="instead of the extension's")
+    p = commands.add_parser("import", parents=[output], help="add the contacts of a pipe-delimited text file")
+    p.add_argument("path")
+    commands.add_parser("batch", help="run the commands on stdin, one per line, answering in JSON lines")
+    return parser
+
+
+def run_command(session, args):
+    # -> a Contact, list of Contacts or message; CommandError when it fails
+    if args.command == "lookup": return session.lookup(args.phone)
+    if args.command == "search": return session.search(args.keyword, args.limit)
+    if args.command == "export": return session.export(args.path, args.group, args.favorites, args.format)
+    if args.command == "import": return session.import_file(args.path)
+    if args.command is None: raise CommandError("Error: No command given.")
+    raise CommandError(f"Error: '{args.command}' cannot be used here.")
+
+
+def _json_result(result):
+    if isinstance(result, Contact): return contact_dict(result)
+    if isinstance(result, list): return [contact_dict(c) for c in result]
+    return result
+
+
+def run_batch(session, parser, lines, out):
+    for number, line in enumerate(lines, 1):
+        try:
+            words = shlex.split(line, comments=True)
+            if not words: continue
+            # --help text must not mix with the JSON answers
+            with contextlib.redirect_stdout(sys.stderr):
+                args = parser.parse_args(words)
+            result = _json_result(run_command(session, args))
+            response = {"ok": True, "result": result}
+        except CommandError as e:
+            response = {"ok": False, "error": str(e)}
+        except ValueError as e:
+            # e.g. unbalanced quotes
+            response = {"ok": False, "error": f"Error: {e}."}
+        except SystemExit:
+            # --help printed its text
+            response = {"ok": False, "error": "Error: No command run."}
+        except Exception as e:
+            # e.g. an unreadable data file: this line fails, the batch carries on
+            response = {"ok": False, "error": f"Error: line {number}: {e}"}
+        out.write(json.dumps(response, ensure_ascii=False) + "\n")
+        # Answer each line at once, for programs that wait for it before the next
+        out.flush()
+
+
+def parse_args(argv):
+    # Exits with status 2 on bad arguments; args.command is None when the menu should start
+    parser = build_parser()
+    try:
+        return parser.parse_args(argv)
+    except CommandError as e:
+        parser.print_usage(sys.stderr)
+        print(e, file=sys.stderr)
+        sys.exit(2)
+
+
+def main(args):
+    # args from parse_args() -> exit status: 0 done, 1 the command failed
+    session = Session(args.data)
+    try:
+        if args.command == "batch":
+            run_batch(session, build_parser(), sys.stdin, sys.stdout)
+            return 0
+        result = run_command(session, args)
+    except CommandError as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        session.close()
+    if args.json:
+        print(json.dumps(_json_result(result), ensure_ascii=False))
+    elif isinstance(result, list):
+        for c in result: print(c)
+    else:
+        print(result)
+    return 0
@@ -0,0 +1,43 @@
+# dedupe.py
+# Duplicate detection by blocking: each contact gets a few hash keys (canonical
+# phone, canonical email) and contacts sharing any key are joined with
+# union-find, in one pass over the list instead of comparing all pairs.
+from models import canonical_phone, canonical_email
+
+
+def blocking_keys(c):
+    keys = [("phone", canonical_phone(c.phone_number))]
+    if c.email: keys.append(("email", canonical_email(c.email)))
+    return keys
+
+
+def find_clusters(contacts):
+    # -> lists of 2+ contact ids (ascending) sharing a phone or an email, ordered by first id
+    parent = {}
+
+    def find(x):
+        root = x
+        while parent.get(root, root) != root:
+            root = parent[root]
+        # Path compression keeps later lookups flat
+        while x != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    owner = {}
+    for c in contacts:
+        c_id = c.contact_id
+        for key in blocking_keys(c):
+            other = owner.setdefault(key, c_id)
+            if other == c_id: continue
+            a, b = find(other), find(c_id)
+            # The smaller id stays the root, so it is the one a merge keeps
+            if a != b:
+                if a < b: parent[b] = a
+                else: parent[a] = b
+
+    # Ids with a parent are the non-root members; roots never get one
+    clusters = {}
+    for c_id in parent:
+        clusters.setdefault(find(c_id), []).append(c_id)
+    return sorted(sorted([root, *members]) for root, members in clusters.items())
@@ -0,0 +1,341 @@
+# indexes.py
+from bisect import bisect_left, bisect_right, insort
+from heapq import nsmallest
+from itertools import islice
+
+_INF = float("inf")
+_NO_KEYS = frozenset()
+
+
+class RelationStore:
+    # Contact <-> group membership kept as two adjacency maps, so every query
+    # costs time proportional to the size of its answer.
+    def __init__(self, pairs=()):
+        self._by_contact = {}
+        self._by_group = {}
+        self._size = 0
+        # When set to a list, each change appends its inverse as (method, args)
+        self.undo_log = None
+        # When set to a set, each change adds the group ids it touched
+        self.changed_groups = None
+        for c_id, g_id in pairs: self.add(c_id, g_id)
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        for c_id, g_ids in self._by_contact.items():
+            for g_id in g_ids: yield (c_id, g_id)
+
+    def __contains__(self, pair):
+        return pair[1] in self._by_contact.get(pair[0], ())
+
+    def clear(self):
+        self._by_contact.clear(); self._by_group.clear()
+        self._size = 0
+
+    def add(self, c_id, g_id):
+        g_ids = self._by_contact.setdefault(c_id, set())
+        if g_id in g_ids: return False
+        g_ids.add(g_id)
+        self._by_group.setdefault(g_id, set()).add(c_id)
+        self._size += 1
+        if self.undo_log is not None: self.undo_log.append((self.remove, (c_id, g_id)))
+        if self.changed_groups is not None: self.changed_groups.add(g_id)
+        return True
+
+    def remove(self, c_id, g_id):
+        g_ids = self._by_contact.get(c_id)
+        if not g_ids or g_id not in g_ids: return False
+        g_ids.discard(g_id)
+        if not g_ids: del self._by_contact[c_id]
+        c_ids = self._by_group[g_id]
+        c_ids.discard(c_id)
+        if not c_ids: del self._by_group[g_id]
+        self._size -= 1
+        if self.undo_log is not None: self.undo_log.append((self.add, (c_id, g_id)))
+        if self.changed_groups is not None: self.changed_groups.add(g_id)
+        return True
+
+    def remove_contact(self, c_id):
+        g_ids = self._by_contact.pop(c_id, set())
+        for g_id in g_ids:
+            c_ids = self._by_group[g_id]
+            c_ids.discard(c_id)
+            if not c_ids: del self._by_group[g_id]
+        self._size -= len(g_ids)
+        if self.undo_log is not None:
+            self.undo_log.extend((self.add, (c_id, g_id)) for g_id in g_ids)
+        if self.changed_groups is not None: self.changed_groups.update(g_ids)
+        return g_ids
+
+    def remove_group(self, g_id):
+        c_ids = self._by_group.pop(g_id, set())
+        for c_id in c_ids:
+            g_ids = self._by_contact[c_id]
+            g_ids.discard(g_id)
+            if not g_ids: del self._by_contact[c_id]
+        self._size -= len(c_ids)
+        if self.undo_log is not None:
+            self.undo_log.extend((self.add, (c_id, g_id)) for c_id in c_ids)
+        if self.changed_groups is not None: self.changed_groups.add(g_id)
+        return c_ids
+
+    def groups_of(self, c_id):
+        return set(self._by_contact.get(c_id, ()))
+
+    def contacts_of(self, g_id):
+        return set(self._by_group.get(g_id, ()))
+
+    def member_count(self, g_id):
+        return len(self._by_group.get(g_id, ()))
+
+    def member_ids(self, g_id):
+        # contacts_of() without the copy: do not modify the result
+        return self._by_group.get(g_id, _NO_KEYS)
+
+
+class KeyIndex:
+    # key -> record for keys that are meant to be unique but need not be (one
+    # phone number saved in two spellings). get() returns the holder with the
+    # smallest id; removing one holder leaves the key to the others.
+    def __init__(self, id_of):
+        self._id_of = id_of
+        self._first = {}
+        # Keys with 2+ holders -> all of them
+        self._shared = {}
+
+    def __len__(self):
+        return len(self._first)
+
+    def __contains__(self, key):
+        return key in self._first
+
+    def get(self, key, default=None):
+        return self._first.get(key, default)
+
+    def holders(self, key):
+        shared = self._shared.get(key)
+        if shared is not None: return sorted(shared, key=self._id_of)
+        first = self._first.get(key)
+        return [] if first is None else [first]
+
+    def build(self, keys, records):
+        # Bulk add() into an empty index; one dict build when no key repeats
+        first = dict(zip(reversed(keys), reversed(records)))
+        if len(first) < len(records):
+            shared = self._shared
+            for key, record in zip(keys, records):
+                holder = first[key]
+                if holder is not record: shared.setdefault(key, {holder}).add(record)
+            for key, holders in shared.items(): first[key] = min(holders, key=self._id_of)
+        self._first = first
+
+    def add(self, key, record):
+        first = self._first.get(key)
+        if first is None:
+            self._first[key] = record
+            return
+        if first is record: return
+        self._shared.setdefault(key, {first}).add(record)
+        if self._id_of(record) < self._id_of(first): self._first[key] = record
+
+    def remove(self, key, record):
+        holders = self._shared.get(key)
+        if holders is None:
+            if self._first.get(key) is record: del self._first[key]
+            return
+        holders.discard(record)
+        if len(holders) == 1: del self._shared[key]
+        if self._first[key] is record: self._first[key] = min(holders, key=self._id_of)
+
+
+class NGramIndex:
+    # Inverted index from character n-grams to record keys. A query's candidates
+    # are the intersection of its grams' posting sets; each candidate is then
+    # verified with a plain substring test, so results match a full scan exactly.
+    def __init__(self, n=3):
+        self.n = n
+        self._postings = {}
+        self._fields = {}
+        # Candidates verified by the last search()
+        self.last_scanned = 0
+
+    def __len__(self):
+        return len(self._fields)
+
+    def clear(self):
+        self._postings.clear(); self._fields.clear()
+
+    def _grams(self, fields):
+        n = self.n
+        return {f[i:i + n] for f in fields for i in range(len(f) - n + 1)}
+
+    def add(self, key, fields):
+        if key in self._fields: self.remove(key)
+        self._fields[key] = fields
+        for gram in self._grams(fields):
+            self._postings.setdefault(gram, set()).add(key)
+
+    def build(self, items):
+        # Bulk version of add() for (key, fields) pairs with new keys
+        n = self.n
+        postings = self._postings
+        for key, fields in items:
+            self._fields[key] = fields
+            for gram in {f[i:i + n] for f in fields for i in range(len(f) - n + 1)}:
+                keys = postings.get(gram)
+                if keys is None: postings[gram] = {key}
+                else: keys.add(key)
+
+    def remove(self, key):
+        fields = self._fields.pop(key, None)
+        if fields is None: return
+        for gram in self._grams(fields):
+            self._drop(gram, key)
+
+    def update(self, key, fields):
+        old = self._fields.get(key)
+        if old is None: return self.add(key, fields)
+        if old == fields: return
+        old_grams, new_grams = self._grams(old), self._grams(fields)
+        self._fields[key] = fields
+        for gram in old_grams - new_grams: self._drop(gram, key)
+        for gram in new_grams - old_grams: self._postings.setdefault(gram, set()).add(key)
+
+    def _drop(self, gram, key):
+        keys = self._postings.get(gram)
+        if keys is None: return
+        keys.discard(key)
+        if not keys: del self._postings[gram]
+
+    def matches(self, key, query):
+        # The substring test search() verifies candidates with
+        fields = self._fields.get(key)
+        return fields is not None and any(query in f for f in fields)
+
+    def _gram_postings(self, query):
+        # Posting sets of the query's grams, smallest first (None: query too short)
+        if len(query) < self.n: return None
+        postings = [self._postings.get(gram, _NO_KEYS) for gram in self._grams((query,))]
+        postings.sort(key=len)
+        return postings
+
+    def candidates(self, query):
+        # None means "too short to use the index": every key is a candidate.
+        # The result may be a posting set itself, do not modify it.
+        postings = self._gram_postings(query)
+        if postings is None: return None
+        if len(postings) == 1 or not postings[0]: return postings[0]
+        result = postings[0] & postings[1]
+        for keys in postings[2:]:
+            result &= keys
+            if not result: break
+        return result
+
+    def search(self, query, limit=None):
+        # -> matching keys; with `limit`, the `limit` smallest ones in order
+        fields = self._fields
+        # A query that is exactly one gram matches every key posted under it
+        exact = len(query) == self.n
+        if limit is None:
+            keys = self.candidates(query)
+            if keys is None: keys = fields
+            self.last_scanned = len(keys)
+            if exact: return list(keys)
+            return [k for k in keys if any(query in f for f in fields[k])]
+        if limit <= 0:
+            self.last_scanned = 0
+            return []
+        postings = self._gram_postings(query)
+        keys = fields if postings is None else postings[0]
+        if exact:
+            self.last_scanned = len(keys)
+            return nsmallest(limit, keys)
+        # Walk the rarest gram's keys in order, verifying each, until `limit` matched
+        found = []
+        scanned = 0
+        for k in sorted(keys):
+            scanned += 1
+            if any(query in f for f in fields[k]):
+                found.append(k)
+                if len(found) >= limit: break
+        self.last_scanned = scanned
+        return found
+
+
+class SortedIndex:
+    # (sort_key, id) pairs kept in order with bisect, so listings never re-sort.
+    # Descending order is by key only: ties stay in ascending id order, the same
+    # as a stable list.sort(reverse=True) over records in id order.
+    def __init__(self, pairs=()):
+        self._items = sorted(pairs)
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, key, item_id):
+        items = self._items
+        pair = (key, item_id)
+        if not items or items[-1] < pair: items.append(pair)
+        else: insort(items, pair)
+
+    def remove(self, key, item_id):
+        items = self._items
+        i = bisect_left(items, (key, item_id))
+        if i < len(items) and items[i] == (key, item_id): del items[i]
+
+    def _run_start(self, key, end, start=0):
+        return bisect_left(self._items, (key,), start, end)
+
+    def _bounds(self, low, high):
+        items = self._items
+        start = 0 if low is None else bisect_left(items, (low,))
+        end = len(items) if high is None else bisect_left(items, (high, _INF))
+        return start, end
+
+    def count_range(self, low=None, high=None):
+        # Pairs with low <= key <= high (None: unbounded)
+        start, end = self._bounds(low, high)
+        return max(end - start, 0)
+
+    def range(self, low=None, high=None, reverse=False):
+        # Yields the (key, id) pairs with low <= key <= high, in iterate() order
+        start, end = self._bounds(low, high)
+        items = self._items
+        if not reverse:
+            yield from islice(items, start, end)
+            return
+        while end > start:
+            key = items[end - 1][0]
+            run = end - 1 if end - 1 == start or items[end - 2][0] != key else self._run_start(key, end, start)
+            yield from items[run:end]
+            end = run
+
+    def iterate(self, reverse=False, offset=0, after=None):
+        # Yields (key, id) pairs; `after` is the pair where a previous page stopped
+        items = self._items
+        if not reverse:
+            start = 0 if after is None else bisect_right(items, tuple(after))
+            yield from islice(items, start + offset, None)
+            return
+        end = len(items)
+        if after is not None:
+            key, item_id = after
+            start = self._run_start(key, end)
+            run_end = bisect_left(items, (key, _INF), start)
+            i = bisect_right(items, (key, item_id), start, run_end)
+            for pair in items[i:run_end]:
+                if offset: offset -= 1
+                else: yield pair
+            end = start
+        while end > 0:
+            key = items[end - 1][0]
+            # Most keys are unique: skip the bisect for runs of one
+            start = end - 1 if end == 1 or items[end - 2][0] != key else self._run_start(key, end)
+            if offset >= end - start:
+                offset -= end - start
+            else:
+                yield from items[start + offset:end]
+                offset = 0
+            end = start
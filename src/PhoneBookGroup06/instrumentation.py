@@ -0,0 +1,118 @@
+# instrumentation.py
+# Opt-in timing and counters for PhoneBookService (see PhoneBookService(instrument=True)).
+import cProfile
+import functools
+import math
+import threading
+import time
+
+# Log-scale buckets: each bucket is 10% wider than the previous one, so
+# percentiles are within ~10% using constant memory. Latencies start at 1 µs.
+BUCKET_GROWTH = 1.1
+BUCKET_COUNT = 260
+LATENCY_MIN = 1e-6
+_LOG_GROWTH = math.log(BUCKET_GROWTH)
+
+
+class Histogram:
+    def __init__(self, minimum=1.0):
+        self.minimum = minimum
+        self.buckets = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        if value > self.max: self.max = value
+        i = 0 if value <= self.minimum else int(math.log(value / self.minimum) / _LOG_GROWTH) + 1
+        self.buckets[min(i, BUCKET_COUNT - 1)] += 1
+
+    def percentile(self, p):
+        if not self.count: return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                # Upper edge of the bucket, never above the largest value seen
+                return min(self.minimum * BUCKET_GROWTH ** i, self.max)
+        return self.max
+
+    def summary(self, scale=1.0):
+        return {"count": self.count, "total": self.total * scale,
+                "mean": self.total / self.count * scale if self.count else 0.0,
+                "p50": self.percentile(50) * scale, "p95": self.percentile(95) * scale,
+                "p99": self.percentile(99) * scale, "max": self.max * scale}
+
+
+class ServiceStats:
+    def __init__(self):
+        self.latency = {}
+        self.values = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def record_call(self, name, seconds):
+        with self._lock:
+            h = self.latency.get(name)
+            if h is None: h = self.latency[name] = Histogram(LATENCY_MIN)
+            h.observe(seconds)
+
+    def observe(self, name, value):
+        with self._lock:
+            h = self.values.get(name)
+            if h is None: h = self.values[name] = Histogram()
+            h.observe(value)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        with self._lock:
+            return {"calls": {k: h.summary(scale=1000.0) for k, h in sorted(self.latency.items())},
+                    "values": {k: h.summary() for k, h in sorted(self.values.items())},
+                    "counters": dict(sorted(self.counters.items()))}
+
+    def reset(self):
+        with self._lock:
+            self.latency.clear(); self.values.clear(); self.counters.clear()
+
+
+def _timed(method, name, stats):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            stats.record_call(name, time.perf_counter() - started)
+    return wrapper
+
+
+def instrument(obj, names, stats, prefix=""):
+    # Shadow each bound method with a timed wrapper on this instance only
+    for name in names:
+        setattr(obj, name, _timed(getattr(obj, name), prefix + name, stats))
+
+
+def format_stats(snapshot):
+    lines = [f"{'Operation':<34} {'Calls':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"]
+    for name, s in snapshot["calls"].items():
+        lines.append(f"{name:<34} {s['count']:>7} {s['p50']:>9.3f} {s['p95']:>9.3f} {s['p99']:>9.3f} {s['max']:>9.3f}")
+    for name, s in snapshot["values"].items():
+        lines.append(f"{name:<34} {s['count']:>7} p50={s['p50']:.0f} p95={s['p95']:.0f} p99={s['p99']:.0f} max={s['max']:.0f}")
+    for name, n in snapshot["counters"].items():
+        lines.append(f"{name:<34} {n:>7}")
+    return "\n".join(lines)
+
+
+def run_profiled(fn, path):
+    # Run fn() under cProfile and write the profile to `path` even if it raises
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(fn)
+    finally:
+        profiler.dump_stats(path)
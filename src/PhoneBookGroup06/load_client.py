@@ -0,0 +1,126 @@
+# load_client.py
+# Load generator for server.py: replays a mix of caller-ID lookups, searches and
+# group queries over several connections, then reports throughput and latency.
+#
+#   python load_client.py --port 8765 --connections 32 --requests 100000
+#   python load_client.py --unix /tmp/phonebook.sock --pipeline 8 --out load.json
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+from instrumentation import Histogram, LATENCY_MIN
+from server import DEFAULT_PORT
+
+# Longest response line accepted
+MAX_RESPONSE_BYTES = 64 << 20
+
+# Request mix: share of caller-ID lookups, searches and group member lists
+DEFAULT_MIX = {"get_contact_by_phone": 0.8, "search": 0.15, "contacts_in_group": 0.05}
+SAMPLE_CONTACTS = 2000
+
+
+async def connect(args):
+    if args.unix:
+        return await asyncio.open_unix_connection(args.unix, limit=MAX_RESPONSE_BYTES)
+    return await asyncio.open_connection(args.host, args.port, limit=MAX_RESPONSE_BYTES)
+
+
+async def call(reader, writer, op, params=None):
+    writer.write(json.dumps({"id": 0, "op": op, "params": params or {}}).encode("utf-8") + b"\n")
+    response = json.loads(await reader.readline())
+    if not response["ok"]: raise RuntimeError(response["error"])
+    return response["result"]
+
+
+async def sample_workload(args):
+    # Phones, name fragments and group ids taken from the served data
+    reader, writer = await connect(args)
+    try:
+        first = await call(reader, writer, "list_contacts", {"limit": 1})
+        total = first["total"]
+        rng = random.Random(args.seed)
+        offset = rng.randrange(max(1, total - SAMPLE_CONTACTS))
+        page = await call(reader, writer, "list_contacts", {"offset": offset, "limit": SAMPLE_CONTACTS})
+        groups = await call(reader, writer, "get_groups")
+    finally:
+        writer.close()
+    contacts = page["contacts"]
+    if not contacts: raise SystemExit("The server has no contacts to query.")
+    phones = [c["phone_number"] for c in contacts]
+    words = [w.lower() for c in contacts for w in c["full_name"].split() if len(w) >= 3] or ["a"]
+    group_ids = [g["group_id"] for g in groups] or [1]
+    return total, phones, words, group_ids
+
+
+def make_request(rng, ops, weights, phones, words, group_ids):
+    op = rng.choices(ops, weights)[0]
+    if op == "get_contact_by_phone": return op, {"phone": rng.choice(phones)}
+    if op == "search": return op, {"keyword": rng.choice(words), "limit": 20}
+    return op, {"id": rng.choice(group_ids), "limit": 20}
+
+
+async def worker(args, n_requests, seed, workload, latency, errors):
+    _, phones, words, group_ids = workload
+    rng = random.Random(seed)
+    ops, weights = list(DEFAULT_MIX), list(DEFAULT_MIX.values())
+    reader, writer = await connect(args)
+    try:
+        sent = 0
+        while sent < n_requests:
+            # Send up to `pipeline` requests, then read their responses in order
+            depth = min(args.pipeline, n_requests - sent)
+            started = []
+            for i in range(depth):
+                op, params = make_request(rng, ops, weights, phones, words, group_ids)
+                writer.write(json.dumps({"id": sent + i, "op": op, "params": params}).encode("utf-8") + b"\n")
+                started.append(time.perf_counter())
+            for t0 in started:
+                line = await reader.readline()
+                latency.observe(time.perf_counter() - t0)
+                if not line or b'"ok": false' in line: errors[0] += 1
+            sent += depth
+    finally:
+        writer.close()
+
+
+async def run(args):
+    workload = await sample_workload(args)
+    latency = Histogram(LATENCY_MIN)
+    errors = [0]
+    per_conn = [args.requests // args.connections + (i < args.requests % args.connections) for i in range(args.connections)]
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(args, n, args.seed + i, workload, latency, errors) for i, n in enumerate(per_conn)))
+    elapsed = time.perf_counter() - started
+    return {"contacts": workload[0], "requests": args.requests, "connections": args.connections,
+            "pipeline": args.pipeline, "errors": errors[0], "seconds": elapsed,
+            "requests_per_s": args.requests / elapsed if elapsed else None,
+            "latency_ms": latency.summary(scale=1000.0)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load generator for server.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", metavar="PATH", help="connect to a Unix socket instead of TCP")
+    parser.add_argument("--connections", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=50000, help="total requests over all connections")
+    parser.add_argument("--pipeline", type=int, default=1, help="requests in flight per connection")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="also write the results as JSON")
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(run(args))
+    lat = result["latency_ms"]
+    print(f"{result['requests']} requests over {result['connections']} connections (pipeline {result['pipeline']}) "
+          f"in {result['seconds']:.2f}s: {result['requests_per_s']:.0f} req/s, {result['errors']} errors", file=sys.stderr)
+    print(f"latency ms  p50 {lat['p50']:.3f}  p95 {lat['p95']:.3f}  p99 {lat['p99']:.3f}  max {lat['max']:.3f}", file=sys.stderr)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# locking.py
+# Locks shared by the service and the storage backends:
+#   RWLock   - many reader threads or one writer thread inside one process
+#   FileLock - advisory lock on a file, so several processes can share one data folder
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Windows has no blocking whole-file lock, poll for it instead
+LOCK_POLL_INTERVAL = 0.05
+
+
+class RWLock:
+    # Waiting writers block new readers, so a steady stream of reads cannot starve
+    # writes. A thread may nest reads, nest writes and read inside its own write;
+    # asking for the write lock while holding only a read lock would deadlock, so
+    # that raises RuntimeError instead.
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._cond = threading.Condition(self._mutex)
+        self._readers = 0
+        self._writer = None
+        self._write_depth = 0
+        self._writers_waiting = 0
+        self._local = threading.local()
+
+    def acquire_read(self):
+        depth = getattr(self._local, "reads", 0)
+        with self._mutex:
+            if not depth and self._writer != threading.get_ident():
+                while self._writer is not None or self._writers_waiting:
+                    self._cond.wait()
+            self._readers += 1
+        self._local.reads = depth + 1
+
+    def release_read(self):
+        self._local.reads -= 1
+        with self._mutex:
+            self._readers -= 1
+            if not self._readers: self._cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._write_depth += 1
+                return
+            if getattr(self._local, "reads", 0):
+                raise RuntimeError("cannot upgrade a read lock to a write lock")
+            self._writers_waiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = me
+            self._write_depth = 1
+
+    def release_write(self):
+        with self._cond:
+            self._write_depth -= 1
+            if not self._write_depth:
+                self._writer = None
+                self._cond.notify_all()
+
+    @property
+    def write_depth(self):
+        # Nesting level of the calling thread's write lock (0 = not the writer)
+        return self._write_depth if self._writer == threading.get_ident() else 0
+
+    def held(self):
+        # True if the calling thread holds the lock in either mode
+        return self._writer == threading.get_ident() or getattr(self._local, "reads", 0) > 0
+
+
+def _lock_fd(fd):
+    if fcntl:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return
+    while True:
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return
+        except OSError:
+            time.sleep(LOCK_POLL_INTERVAL)
+
+
+def _unlock_fd(fd):
+    if fcntl:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+class FileLock:
+    # Exclusive advisory lock on `path` (created if missing). Other processes using
+    # FileLock on the same path wait; threads of this process queue on a mutex, and
+    # the thread holding it may re-enter.
+    def __init__(self, path):
+        self.path = path
+        self._mutex = threading.RLock()
+        self._fd = None
+        self._depth = 0
+
+    def acquire(self):
+        self._mutex.acquire()
+        if not self._depth:
+            try:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    _lock_fd(fd)
+                except BaseException:
+                    os.close(fd)
+                    raise
+            except BaseException:
+                self._mutex.release()
+                raise
+            self._fd = fd
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if not self._depth:
+            fd, self._fd = self._fd, None
+            try:
+                _unlock_fd(fd)
+            finally:
+                os.close(fd)
+        self._mutex.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -1,9 +1,23 @@
 # main.py
 import os
+import sys
 import time
-from services import PhoneBookService
+from cli import open_service, parse_args, main as run_cli
+from instrumentation import format_stats, run_profiled
 
-service = PhoneBookService()
+# With arguments, runs one command instead of the menu (see cli.py):
+#   python main.py lookup 0912345678 / search tran / export out.csv --group 3 / import file.txt / batch
+#   python main.py --data <folder> starts the menu on another data folder
+# Settings, also used by the commands:
+# PHONEBOOK_JOURNAL=1 appends each change to data/journal.log instead of rewriting all files
+# PHONEBOOK_BACKEND=sqlite keeps the data in data/phonebook.db (copied from the text files once)
+# PHONEBOOK_STATS=1 times every service call, menu [9] shows the numbers
+# PHONEBOOK_WRITE_BEHIND=1 saves changes in the background, shortly after they are made
+# PHONEBOOK_WATCH=1 picks up changes other programs make to the data files while running
+# PHONEBOOK_PROFILE=<file> writes a cProfile dump of the whole session to <file>
+
+# Loaded when the menu starts, not on import
+service = None
 
 def clear_screen():
     os.system('cls' if os.name == 'nt' else 'clear')
@@ -13,6 +27,9 @@ def print_header(title):
     print(f"   {title.upper()}")
     print("="*50)
 
+# Rows per screen in the contact list
+PAGE_SIZE = 20
+
 def input_str(prompt, current_val=None):
     if current_val:
         val = input(f"{prompt} [{current_val}]: ").strip()
@@ -134,6 +151,7 @@ def view_contacts_ui():
     current_sort = 'id'
     sort_label = "ID (Default)"
     notification = "" 
+    page = 0
 
     while True:
         clear_screen()
@@ -146,7 +164,10 @@ def view_contacts_ui():
             notification = "" 
         # --------------------------
         
-        contacts = service.get_all_contacts(sort_by=current_sort)
+        contacts, total = service.get_contacts_page(current_sort, page * PAGE_SIZE, PAGE_SIZE)
+        page_count = max(1, (total + PAGE_SIZE - 1) // PAGE_SIZE)
+        if not contacts and page > 0:
+            page = page_count - 1; continue
         if not contacts: 
             print(">> No contacts found in system.")
         else:
@@ -154,6 +175,7 @@ def view_contacts_ui():
             print("-" * 55)
             for c in contacts: print(c)
             print("-" * 55)
+            print(f"Page {page + 1}/{page_count} ({total} contacts)")
             
         # --- LOGIC XÁC ĐỊNH HÀNH ĐỘNG TIẾP THEO CỦA NÚT S ---
         if current_sort == 'id':
@@ -169,6 +191,7 @@ def view_contacts_ui():
         print("[Number] Enter ID to View Detail")
         print("[A]      Add New Contact")
         print("[F]      Find / Search")
+        print("[N]/[P]  Next / Previous Page")
         print(f"[S]      {next_sort_msg}")  # Dòng S nằm chung nhóm
         print("[M]      Back to Main Menu")
         print("-" * 30)
@@ -180,8 +203,13 @@ def view_contacts_ui():
             add_contact_ui()
         elif choice == 'F': 
             search_ui()
+        elif choice == 'N':
+            if page + 1 < page_count: page += 1
+        elif choice == 'P':
+            if page > 0: page -= 1
         elif choice == 'S':
             # Logic đổi trạng thái sắp xếp
+            page = 0
             if current_sort == 'id': 
                 current_sort = 'name_asc'
                 sort_label = "Name (A-Z)"
@@ -260,7 +288,7 @@ def manage_groups_ui():
             groups = service.get_all_groups()
             if not groups: print(">> No groups found.")
             else: 
-                for g in groups: print(g)
+                for g in groups: print(f"{g} ({service.get_group_member_count(g.group_id)} members)")
             input("\nPress Enter to return...")
             
         elif choice == '2':
@@ -329,7 +357,7 @@ def import_export_ui():
         clear_screen()
         print_header("IMPORT / EXPORT")
         print("[1] Import from TXT file")
-        print("[2] Export to TXT file")
+        print("[2] Export to file (TXT/CSV/JSONL)")
         print("[0] Back")
         
         choice = input("Choice: ")
@@ -339,20 +367,63 @@ def import_export_ui():
             print_header("IMPORT DATA")
             path = input("Enter file path (e.g. data/contacts.txt): ")
             print(">> Processing...")
-            success, msg = service.import_contacts_from_file(path)
+            def show_progress(rows, rate):
+                print(f"\r>> {rows} rows read ({rate:.0f} rows/s)", end="", flush=True)
+            success, msg = service.import_contacts_from_file(path, progress=show_progress)
+            print()
             print(f">> {msg}")
             input("Press Enter to return...")
             
         elif choice == '2':
             clear_screen()
             print_header("EXPORT DATA")
+            print("(Format follows the extension: .txt, .csv, .jsonl, add .gz to compress)")
             path = input("Enter destination path (e.g. data/backup.txt): ")
-            success, msg = service.export_contacts_to_file(path)
+            scope = input("Export [Enter] All, [F] Favorites only, [G] One group: ").strip().upper()
+            try:
+                group_id = int(input("Group ID: ")) if scope == 'G' else None
+                success, msg = service.export_contacts_to_file(path, favorites_only=(scope == 'F'), group_id=group_id)
+            except ValueError:
+                msg = "Error: Invalid ID"
             print(f">> {msg}")
             input("Press Enter to return...")
             
         elif choice == '0': break
 
+def duplicates_ui():
+    clear_screen()
+    print_header("Duplicate Contacts")
+    print(">> Scanning...")
+    clusters = service.find_duplicates()
+    if not clusters:
+        print(">> No duplicates found (same phone number or email).")
+        input("\nPress Enter to return...")
+        return
+    print(f">> {len(clusters)} groups of duplicates, {sum(len(c) for c in clusters)} contacts:\n")
+    for cluster in clusters[:10]:
+        for c in cluster: print(c)
+        print("-" * 50)
+    if len(clusters) > 10: print(f"... and {len(clusters) - 10} more groups")
+    confirm = input("Merge each group into its oldest contact? (y/n): ").strip().lower()
+    if confirm == 'y':
+        success, msg = service.merge_duplicates()
+        print(f">> {msg}")
+    input("\nPress Enter to return...")
+
+def stats_ui():
+    clear_screen()
+    print_header("Performance Stats")
+    stats = service.get_stats()
+    if not stats["enabled"]:
+        print("Stats are off. Start the program with PHONEBOOK_STATS=1 to collect them.")
+    else:
+        cache = stats["cache"]
+        print(f"Storage: {stats['storage']} | Contacts: {stats['contacts']}")
+        if "hits" in cache: print(f"Result cache: {cache['hits']} hits, {cache['misses']} misses, {cache['entries']} entries")
+        print()
+        print(format_stats(stats))
+    input("\nPress Enter to return...")
+
 def main_menu():
     while True:
         clear_screen()
@@ -364,6 +435,8 @@ def main_menu():
         print("[3] Manage Groups")
         print("[4] Search Contact")
         print("[5] Import/Export")
+        print("[6] Find Duplicates")
+        if service.stats is not None: print("[9] Performance Stats")
         print("[0] Exit")
         print("=============================================")
         
@@ -374,6 +447,8 @@ def main_menu():
         elif choice == '3': manage_groups_ui()
         elif choice == '4': search_ui()
         elif choice == '5': import_export_ui()
+        elif choice == '6': duplicates_ui()
+        elif choice == '9': stats_ui()
         elif choice == '0': 
             print("Goodbye!"); break
         else:
@@ -381,9 +456,17 @@ def main_menu():
             time.sleep(1)
 
 if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    if args.command: sys.exit(run_cli(args))
+    service = open_service(args.data, watch=os.environ.get("PHONEBOOK_WATCH") == "1")
     try:
-        main_menu()
+        profile_path = os.environ.get("PHONEBOOK_PROFILE")
+        if profile_path: run_profiled(main_menu, profile_path)
+        else: main_menu()
     except Exception as e:
         print(f"\n!!!! PROGRAM CRASHED !!!!")
         print(f"Error details: {e}")
-        input("\nPress Enter to exit...")
\ No newline at end of file
+        input("\nPress Enter to exit...")
+    finally:
+        # Write-behind mode: changes not saved yet are written here
+        service.close()
\ No newline at end of file
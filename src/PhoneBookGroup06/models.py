@@ -1,28 +1,152 @@
-# models.py
 from datetime import datetime
+from functools import lru_cache
+import calendar
+import re
+import sys
+import time
+import unicodedata
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# created_at is kept as an int: seconds of the wall-clock time written in the file,
+# counted like calendar.timegm (no timezone/DST lookup), so it round-trips exactly.
+def parse_timestamp(text):
+    if len(text) != 19 or text[4] != "-" or text[7] != "-" or text[10] != " " or text[13] != ":" or text[16] != ":":
+        return None
+    try:
+        return calendar.timegm((int(text[0:4]), int(text[5:7]), int(text[8:10]),
+                                int(text[11:13]), int(text[14:16]), int(text[17:19])))
+    except ValueError:
+        return None
+
+@lru_cache(maxsize=4096)
+def format_timestamp(ts):
+    return time.strftime(TIME_FORMAT, time.gmtime(ts))
+
+def now_timestamp():
+    return calendar.timegm(time.localtime())
+
+def to_bool(value):
+    if isinstance(value, bool): return value
+    return str(value).strip().lower() in ("true", "1", "yes")
+
+# Sort key used for name ordering: the last word, e.g. "Nguyen Van A" -> "a"
+def name_sort_key(full_name):
+    if not full_name: return ""
+    return full_name.strip().split(" ")[-1].lower()
+
+# Search keys: "Nguyễn Đức" -> "nguyen duc", "090-123 4567" -> "0901234567", so
+# queries typed without diacritics or separators still match
+NON_DIGITS = re.compile(r"\D")
+# A query made only of digits and phone punctuation is matched as digits
+PHONE_QUERY = re.compile(r"^[\d\s().+-]*\d[\d\s().+-]*$")
+
+@lru_cache(maxsize=65536)
+def _fold_word(word):
+    # đ has no decomposition in Unicode, map it by hand
+    word = unicodedata.normalize("NFKD", word.casefold()).replace("đ", "d")
+    return "".join(ch for ch in word if not unicodedata.combining(ch))
+
+def fold_text(text):
+    if text.isascii(): return text.lower()
+    # Names reuse a small set of words, so folding word by word mostly hits the cache
+    return " ".join(map(_fold_word, text.split(" ")))
+
+def digits_only(text):
+    return text if text.isdigit() else NON_DIGITS.sub("", text)
+
+def query_key(keyword):
+    return digits_only(keyword) if PHONE_QUERY.match(keyword) else fold_text(keyword)
+
+# What a query_key() is looked for in: a contact matches if any of these contains it
+def search_fields(full_name, phone_number, email):
+    return (fold_text(full_name), digits_only(phone_number), fold_text(email))
+
+# Identity keys: "+84 912-345-678", "0084912345678" and "0912345678" are one number
+def canonical_phone(phone):
+    digits = digits_only(phone)
+    if not digits: return phone.strip()
+    if digits.startswith("0084"):
+        digits = digits[4:]
+    elif digits.startswith("84") and (phone.lstrip().startswith("+") or len(digits) >= 11):
+        digits = digits[2:]
+    else:
+        return digits
+    return digits if digits.startswith("0") else "0" + digits
+
+# "A.B+news@GMail.com" -> "ab@gmail.com": case, +tags and Gmail's dots do not matter
+def canonical_email(email):
+    email = email.strip().lower()
+    local, at, domain = email.rpartition("@")
+    if not at: return email
+    local = local.split("+", 1)[0]
+    if domain in ("gmail.com", "googlemail.com"):
+        local, domain = local.replace(".", ""), "gmail.com"
+    return local + "@" + domain
 
 class Contact:
+    __slots__ = ("contact_id", "full_name", "phone_number", "email", "address", "note", "is_favorite", "_created")
+
     def __init__(self, contact_id, full_name, phone_number, email="", address="", note="", is_favorite=False, created_at=None):
         self.contact_id = contact_id
         self.full_name = full_name
         self.phone_number = phone_number
         self.email = email
-        self.address = address
-        self.note = note
-        self.is_favorite = is_favorite # [cite: 243]
-        
+        # Address/note values repeat a lot ("hcm", "hn"...), share one copy of each
+        self.address = sys.intern(address) if address else ""
+        self.note = sys.intern(note) if note else ""
+        self.is_favorite = to_bool(is_favorite) # [cite: 243]
+
         # Tự động gán thời gian nếu không có
-        self.created_at = created_at if created_at else datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.created_at = created_at
+
+    @property
+    def created_at(self):
+        ts = self._created
+        # Values that are not in the standard format are kept as they were read
+        return ts if ts.__class__ is str else format_timestamp(ts)
+
+    @created_at.setter
+    def created_at(self, value):
+        if not value:
+            self._created = now_timestamp()
+        elif isinstance(value, int):
+            self._created = value
+        else:
+            ts = parse_timestamp(value)
+            self._created = ts if ts is not None else sys.intern(value)
+
+    @property
+    def created_ts(self):
+        ts = self._created
+        if ts.__class__ is not str: return ts
+        try:
+            return calendar.timegm(datetime.fromisoformat(ts).timetuple())
+        except ValueError:
+            return 0
 
     def __str__(self):
         fav_str = "[*]" if self.is_favorite else "[ ]"
         return f"{self.contact_id:<5} | {self.full_name:<20} | {self.phone_number:<12} | {fav_str}"
 
 class Group:
+    __slots__ = ("group_id", "group_name", "description")
+
     def __init__(self, group_id, group_name, description=""):
         self.group_id = group_id
         self.group_name = group_name
         self.description = description # [cite: 251]
 
     def __str__(self):
-        return f"{self.group_id:<5} | {self.group_name:<20} | {self.description}"
\ No newline at end of file
+        return f"{self.group_id:<5} | {self.group_name:<20} | {self.description}"
+
+# JSON-ready forms, shared by the server and the command line
+def contact_dict(c):
+    if c is None: return None
+    return {"contact_id": c.contact_id, "full_name": c.full_name, "phone_number": c.phone_number,
+            "email": c.email, "address": c.address, "note": c.note,
+            "is_favorite": c.is_favorite, "created_at": c.created_at}
+
+def group_dict(g):
+    if g is None: return None
+    return {"group_id": g.group_id, "group_name": g.group_name, "description": g.description}
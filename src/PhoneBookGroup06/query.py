@@ -0,0 +1,177 @@
+# query.py
+# Composable contact queries:
+#
+#   service.query().favorites().in_group(3).matching("tran").order_by("created_desc").limit(20).all()
+#
+# Each filter can list its candidates from an index (favorite ids, group members,
+# a range of the "created" ordering, search n-gram postings). The planner starts
+# from the filter with the fewest candidates and checks the others per contact.
+# When a few results are wanted out of many candidates it walks the sort order
+# instead and stops at the limit, so nothing is sorted or collected on the way.
+from heapq import nsmallest, nlargest
+from itertools import islice
+
+from models import parse_timestamp, query_key
+
+
+def _timestamp(value, end_of_day=False):
+    if value is None or isinstance(value, int): return value
+    text = str(value).strip()
+    if len(text) == 10: text += " 23:59:59" if end_of_day else " 00:00:00"
+    ts = parse_timestamp(text)
+    if ts is None: raise ValueError(f"Invalid date '{value}', use YYYY-MM-DD or YYYY-MM-DD HH:MM:SS.")
+    return ts
+
+
+class Query:
+    # Built by PhoneBookService.query(); every method but all()/explain() returns the query
+    def __init__(self, service):
+        self._service = service
+        self.favorite = None
+        self.group_ids = []
+        self.created_from = None
+        self.created_to = None
+        self.text = None
+        self.sort_by = "id"
+        self.max_results = None
+
+    # --- FILTERS ---
+    def favorites(self, flag=True):
+        self.favorite = bool(flag)
+        return self
+
+    def in_group(self, g_id):
+        # Called several times: members of all the groups
+        self.group_ids.append(g_id)
+        return self
+
+    def created_between(self, start=None, end=None):
+        # Inclusive, "YYYY-MM-DD" / "YYYY-MM-DD HH:MM:SS" or timestamps; None = open end
+        self.created_from = _timestamp(start)
+        self.created_to = _timestamp(end, end_of_day=True)
+        return self
+
+    def matching(self, keyword):
+        # Same matching as search_contact()
+        self.text = query_key(keyword) if keyword else None
+        return self
+
+    # --- RESULT SHAPE ---
+    def order_by(self, sort_by):
+        # A key of services.SORT_MODES
+        self.sort_by = sort_by
+        return self
+
+    def limit(self, n):
+        self.max_results = n
+        return self
+
+    # --- RESULTS ---
+    def all(self):
+        return self._service.run_query(self)
+
+    def explain(self):
+        return self._service.explain_query(self)
+
+
+class _Filter:
+    __slots__ = ("name", "size", "ids", "check")
+
+    def __init__(self, name, size, ids, check):
+        # ids: candidate id set, a (key, id) range of the created ordering, or None (no index)
+        self.name, self.size, self.ids, self.check = name, size, ids, check
+
+
+class Plan:
+    __slots__ = ("driver", "checks", "walk", "kind", "reverse", "limit")
+
+    def __str__(self):
+        if self.walk and self.driver: start = f"{self.driver.name} in {self.kind} order ({self.driver.size} rows)"
+        elif self.walk: start = f"walk {self.kind} order"
+        else: start = f"{self.driver.name} ({self.driver.size} rows)"
+        parts = [start]
+        if self.checks: parts.append("check " + ", ".join(f.name for f in self.checks))
+        if not self.walk: parts.append(f"sort by {self.kind}")
+        if self.limit is not None: parts.append(f"limit {self.limit}")
+        return " -> ".join(parts)
+
+
+def _filters(service, q):
+    filters = []
+    total = len(service.contacts)
+    if q.favorite is True:
+        ids = service._favorite_ids
+        filters.append(_Filter("favorite", len(ids), ids, lambda c: c.is_favorite))
+    elif q.favorite is False:
+        filters.append(_Filter("not favorite", total - len(service._favorite_ids), None, lambda c: not c.is_favorite))
+    for g_id in q.group_ids:
+        members = service.relations.member_ids(g_id)
+        filters.append(_Filter(f"group {g_id}", len(members), members, lambda c, m=members: c.contact_id in m))
+    if q.created_from is not None or q.created_to is not None:
+        low, high = q.created_from, q.created_to
+        size = service._get_order("created").count_range(low, high)
+        filters.append(_Filter("created", size, (low, high),
+                               lambda c: (low is None or c.created_ts >= low) and (high is None or c.created_ts <= high)))
+    if q.text:
+        index, text = service._get_search_index(), q.text
+        ids = index.candidates(text)
+        filters.append(_Filter(f"text '{text}'", total if ids is None else len(ids), ids,
+                               lambda c: index.matches(c.contact_id, text)))
+    return filters
+
+
+def plan_query(service, q, kind, reverse):
+    # Called under the service's read lock
+    total = len(service.contacts)
+    filters = _filters(service, q)
+    p = Plan()
+    p.kind, p.reverse, p.limit = kind, reverse, q.max_results
+    p.driver = min((f for f in filters if f.ids is not None), key=lambda f: f.size, default=None)
+    if p.driver is not None and p.driver.ids.__class__ is tuple and kind == "created":
+        # The created range is already in the wanted order
+        p.walk = True
+    elif p.driver is None or not p.driver.size or not total:
+        p.walk = p.driver is None
+    elif p.limit is None:
+        p.walk = False
+    else:
+        # Filters taken as independent: walking the order meets `limit` matches
+        # after about limit * total / matches rows, collecting costs the driver's size
+        matches = float(total)
+        for f in filters: matches *= f.size / total
+        p.walk = p.limit * total / max(matches, 1.0) < p.driver.size
+        if p.walk: p.driver = None
+    p.checks = [f for f in filters if f is not p.driver]
+    return p
+
+
+def execute(service, p):
+    by_id = service._contact_by_id
+    order = service._get_order(p.kind) if p.walk else None
+    if p.walk and p.driver:
+        ids = (i for _, i in order.range(*p.driver.ids, reverse=p.reverse))
+    elif p.walk:
+        ids = (i for _, i in order.iterate(p.reverse))
+    elif p.driver.ids.__class__ is tuple:
+        ids = (i for _, i in service._get_order("created").range(*p.driver.ids))
+    else:
+        ids = p.driver.ids
+    checks = [f.check for f in p.checks]
+    # Group members may name contacts that no longer exist; get_contacts_in_group skips them too
+    matches = (c for c in map(by_id.get, ids) if c is not None and all(check(c) for check in checks))
+    if p.walk: return list(islice(matches, p.limit))
+
+    if p.kind == "id":
+        key = None
+    else:
+        kind, order_key = p.kind, service._order_key
+        key = lambda c: order_key(kind, c)
+    if not p.reverse:
+        full_key = (lambda c: c.contact_id) if key is None else (lambda c: (key(c), c.contact_id))
+        if p.limit is None: return sorted(matches, key=full_key)
+        return nsmallest(p.limit, matches, key=full_key)
+    # Descending by key, ties in ascending id order like the sorted orderings
+    found = sorted(matches, key=lambda c: c.contact_id)
+    if key is None: key = lambda c: c.contact_id
+    if p.limit is None: return sorted(found, key=key, reverse=True)
+    return nlargest(p.limit, found, key=key)
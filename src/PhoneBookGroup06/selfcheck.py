@@ -0,0 +1,386 @@
+# selfcheck.py
+# Randomized consistency checks for PhoneBookService, no interactive menu.
+#
+#   python selfcheck.py                      # seeds 1-6, 400 operations each
+#   python selfcheck.py --seeds 3 --ops 2000 --every 10
+#
+# Each seed starts from files holding one number in several spellings, runs
+# random changes on a service whose indexes, orderings, result cache and snapshot
+# views are all in use, and makes the same changes to Reference: the service's
+# rules over plain lists, answered by scanning them. Every change must return
+# what the reference returns, and every few operations everything the service
+# answers is compared with the reference and with a fresh service loaded from
+# the same files. A transaction() that fails must leave every answer as it was
+# before it. The seeds cycle through the plain, journal and write-behind modes.
+# Exits with status 1 at the first difference.
+import argparse
+import copy
+import random
+import shutil
+import sys
+import tempfile
+
+from models import Contact, Group, canonical_phone, name_sort_key, query_key, search_fields, parse_timestamp
+from services import PhoneBookService, SORT_MODES, EMAIL_PATTERN
+from storage import TextFileBackend
+
+MODES = ("plain", "journal", "write_behind")
+NAMES = ["An", "Bình", "Lê Văn An", "Trần Thị Bình", "Nguyễn An", "Phạm Hùng", "Đỗ Mai", "Lý Gia Yến", "Tùng"]
+GROUP_NAMES = ["Gia đình", "Bạn bè", "Đồng nghiệp", "VIP", "CLB"]
+# Spellings of one number that canonical_phone() treats as the same
+PHONE_SPELLINGS = ["09010000{:02d}", "+84 9010000{:02d}", "0084 9010000{:02d}"]
+KEYWORDS = ["an", "bình", "binh", "tran", "0901", "09010000", "gmail", "y", "nguyen an", "xyz"]
+
+
+class CheckFailed(Exception):
+    pass
+
+
+class _Abort(Exception):
+    pass
+
+
+def _contact(c):
+    return (c.contact_id, c.full_name, c.phone_number, c.email, c.address, c.note, c.is_favorite, c.created_at)
+
+
+def _ids(contacts):
+    return [c.contact_id for c in contacts]
+
+
+def describe(s):
+    # Everything the service answers, in comparable form
+    d = {"contacts": sorted(map(_contact, s.get_all_contacts())),
+         "groups": sorted((g.group_id, g.group_name, g.description) for g in s.get_all_groups()),
+         "relations": sorted(s.relations)}
+    for mode in SORT_MODES:
+        d["all " + mode] = _ids(s.get_all_contacts(mode))
+        page, total = s.get_contacts_page(mode, 2, 7)
+        d["page " + mode] = (_ids(page), total)
+        walked, cursor = [], None
+        while True:
+            page, cursor = s.get_contacts_after(mode, cursor, 5)
+            walked += _ids(page)
+            if cursor is None: break
+        d["after " + mode] = walked
+    for kw in KEYWORDS:
+        d["search " + kw] = (_ids(s.search_contact(kw)), _ids(s.search_contact(kw, 3)))
+    for c in s.get_all_contacts():
+        found = s.get_contact_by_phone(c.phone_number)
+        d[f"phone {c.contact_id}"] = found and found.contact_id
+        d[f"groups of {c.contact_id}"] = sorted(g.group_id for g in s.get_groups_of_contact(c.contact_id))
+    view = s.snapshot_view()
+    d["view"] = [_contact(c) for c in view.contacts()]
+    for g in s.get_all_groups():
+        g_id = g.group_id
+        d[f"members {g_id}"] = (_ids(s.get_contacts_in_group(g_id)), s.get_group_member_count(g_id),
+                                sorted(view.member_ids(g_id)))
+        d[f"query {g_id}"] = _ids(s.query().in_group(g_id).matching("an").order_by("name_desc").limit(4).all())
+    d["favorites"] = _ids(s.query().favorites().order_by("name_asc").limit(5).all())
+    d["recent"] = _ids(s.query().favorites(False).created_between("2000-01-01", None).order_by("created_desc").limit(6).all())
+    return d
+
+
+def compare(label, got, expected, names=("live", "reloaded")):
+    for key in expected.keys() | got.keys():
+        if got.get(key) != expected.get(key):
+            raise CheckFailed(f"{label}: '{key}' differs\n  {names[0]}: {got.get(key)}\n  {names[1]}: {expected.get(key)}")
+
+
+class Reference:
+    # The service's rules over plain lists, written without its indexes: each
+    # method returns what the PhoneBookService method of the same name should
+    def __init__(self, contacts, groups, relations):
+        self.contacts = [Contact(c.contact_id, c.full_name, c.phone_number, c.email, c.address, c.note,
+                                 c.is_favorite, c.created_at) for c in contacts]
+        self.groups = [Group(g.group_id, g.group_name, g.description) for g in groups]
+        self.relations = set(relations)
+        # Ids are never reused, even after the newest contact/group is deleted
+        self.next_contact_id = max((c.contact_id for c in contacts), default=0) + 1
+        self.next_group_id = max((g.group_id for g in groups), default=0) + 1
+
+    def contact(self, c_id):
+        return next((c for c in self.contacts if c.contact_id == c_id), None)
+
+    def group(self, g_id):
+        return next((g for g in self.groups if g.group_id == g_id), None)
+
+    def phone_taken(self, phone):
+        return any(canonical_phone(c.phone_number) == canonical_phone(phone) for c in self.contacts)
+
+    def add_contact(self, full_name, phone, email, address, note):
+        if not phone: return False, "Error: Phone number is required."
+        if self.phone_taken(phone): return False, "Error: Phone number already exists."
+        if email and not EMAIL_PATTERN.match(email): return False, "Error: Invalid email format."
+        self.contacts.append(Contact(self.next_contact_id, full_name, phone, email, address, note))
+        self.next_contact_id += 1
+        return True, "Success: Contact added."
+
+    def update_contact(self, c_id, name, phone, email, address, note):
+        c = self.contact(c_id)
+        if not c: return False, "Error: Contact not found."
+        if phone and canonical_phone(phone) != canonical_phone(c.phone_number) and self.phone_taken(phone):
+            return False, "Error: New phone number is already taken."
+        if email and not EMAIL_PATTERN.match(email): return False, "Error: Invalid email format."
+        for attr, value in (("full_name", name), ("phone_number", phone), ("email", email), ("address", address), ("note", note)):
+            if value: setattr(c, attr, value)
+        return True, "Success: Contact updated."
+
+    def delete_contact(self, c_id):
+        c = self.contact(c_id)
+        if not c: return False
+        self.contacts.remove(c)
+        self.relations = {r for r in self.relations if r[0] != c_id}
+        return True
+
+    def toggle_favorite(self, c_id):
+        c = self.contact(c_id)
+        if not c: return False, "Error: Contact not found."
+        c.is_favorite = not c.is_favorite
+        return True, "Success: Favorite status updated."
+
+    def merge_contacts(self, keep_id, other_ids):
+        keep = self.contact(keep_id)
+        others = [self.contact(i) for i in dict.fromkeys(other_ids) if i != keep_id and self.contact(i)]
+        if not keep: return False, "Error: Contact not found."
+        if not others: return False, "Error: Nothing to merge."
+        for attr in ("full_name", "email", "address", "note"):
+            if not getattr(keep, attr):
+                setattr(keep, attr, next((getattr(o, attr) for o in others if getattr(o, attr)), ""))
+        # Numbers other than keep's go into its note, one per phone key, unless already there
+        numbers = []
+        for o in others:
+            key = canonical_phone(o.phone_number)
+            if key != canonical_phone(keep.phone_number) and key not in map(canonical_phone, numbers):
+                numbers.append(o.phone_number)
+        numbers = [n for n in numbers if n not in keep.note]
+        if numbers: keep.note = (keep.note + "; " if keep.note else "") + "Other phones: " + ", ".join(numbers)
+        if any(o.is_favorite for o in others): keep.is_favorite = True
+        for o in others:
+            self.relations |= {(keep_id, g_id) for c_id, g_id in self.relations if c_id == o.contact_id}
+            self.delete_contact(o.contact_id)
+        msg = f"Success: Merged {len(others)} contacts into #{keep_id}."
+        if numbers: msg += f" Kept {len(numbers)} other phone numbers in its note."
+        return True, msg
+
+    def create_group(self, name, desc):
+        if not name: return False, "Error: Group name is required."
+        if any(g.group_name.lower() == name.lower() for g in self.groups): return False, "Error: Group name already exists."
+        self.groups.append(Group(self.next_group_id, name, desc))
+        self.next_group_id += 1
+        return True, "Success: Group created."
+
+    def update_group(self, g_id, new_name, new_desc):
+        g = self.group(g_id)
+        if not g: return False, "Error: Group not found."
+        if new_name and new_name.lower() != g.group_name.lower():
+            if any(o.group_name.lower() == new_name.lower() for o in self.groups): return False, "Error: Group name already exists."
+            g.group_name = new_name
+        if new_desc: g.description = new_desc
+        return True, "Success: Group updated."
+
+    def delete_group(self, g_id):
+        g = self.group(g_id)
+        if not g: return False, "Error: Group not found."
+        self.groups.remove(g)
+        self.relations = {r for r in self.relations if r[1] != g_id}
+        return True, "Success: Group deleted."
+
+    def assign_contact_to_group(self, c_id, g_id):
+        # Like the service, ids are not checked: relations may point at missing contacts
+        if (c_id, g_id) in self.relations: return False, "Error: Already in this group."
+        self.relations.add((c_id, g_id))
+        return True, "Success: Assigned to group."
+
+    def remove_contact_from_group(self, c_id, g_id):
+        if (c_id, g_id) not in self.relations: return False, "Error: Relation not found."
+        self.relations.discard((c_id, g_id))
+        return True, "Success: Removed from group."
+
+
+def expected(ref):
+    # describe() worked out from the reference, by sorting and scanning its lists
+    by_id = sorted(ref.contacts, key=lambda c: c.contact_id)
+    ids = {c.contact_id for c in by_id}
+    sort_keys = {"id": lambda c: c.contact_id, "name": lambda c: name_sort_key(c.full_name), "created": lambda c: c.created_ts}
+    d = {"contacts": sorted(map(_contact, by_id)),
+         "groups": sorted((g.group_id, g.group_name, g.description) for g in ref.groups),
+         "relations": sorted(ref.relations)}
+    for mode, (kind, reverse) in SORT_MODES.items():
+        # A stable sort of the id order: equal keys stay in ascending id order either way
+        listed = _ids(sorted(by_id, key=sort_keys[kind], reverse=reverse))
+        d["all " + mode] = listed
+        d["page " + mode] = (listed[2:9], len(listed))
+        d["after " + mode] = listed
+
+    def matches(c, text):
+        return any(text in f for f in search_fields(c.full_name, c.phone_number, c.email))
+
+    for kw in KEYWORDS:
+        found = [c.contact_id for c in by_id if matches(c, query_key(kw))]
+        d["search " + kw] = (found, found[:3])
+    for c in by_id:
+        d[f"phone {c.contact_id}"] = next(o.contact_id for o in by_id
+                                          if canonical_phone(o.phone_number) == canonical_phone(c.phone_number))
+        d[f"groups of {c.contact_id}"] = sorted(g_id for c_id, g_id in ref.relations
+                                                if c_id == c.contact_id and ref.group(g_id))
+    d["view"] = [_contact(c) for c in by_id]
+    for g in ref.groups:
+        members = sorted(c_id for c_id, g_id in ref.relations if g_id == g.group_id)
+        d[f"members {g.group_id}"] = ([i for i in members if i in ids], len(members), members)
+        found = [c for c in by_id if c.contact_id in members and matches(c, query_key("an"))]
+        d[f"query {g.group_id}"] = _ids(sorted(found, key=sort_keys["name"], reverse=True)[:4])
+    d["favorites"] = _ids(sorted((c for c in by_id if c.is_favorite), key=sort_keys["name"])[:5])
+    since = parse_timestamp("2000-01-01 00:00:00")
+    recent = [c for c in by_id if not c.is_favorite and c.created_ts >= since]
+    d["recent"] = _ids(sorted(recent, key=sort_keys["created"], reverse=True)[:6])
+    return d
+
+
+def spelling(n, rng):
+    return rng.choice(PHONE_SPELLINGS).format(n)
+
+
+def pick_change(s, rng):
+    # -> (method name, arguments) of a random change, valid or not
+    ids = [c.contact_id for c in s.contacts] or [1]
+    g_ids = [g.group_id for g in s.groups] or [1]
+    c_id = rng.choice(ids + [max(ids) + 1])
+    g_id = rng.choice(g_ids + [max(g_ids) + 1])
+    phone = spelling(rng.randrange(60), rng)
+    email = rng.choice(["", "", "an@gmail.com", f"user{rng.randrange(9)}@mail.vn", "bad-email"])
+    op = rng.randrange(12)
+    if op <= 2: return "add_contact", (rng.choice(NAMES), phone, email, rng.choice(["", "hn", "hcm"]), "")
+    if op == 3: return "update_contact", (c_id, rng.choice(NAMES + [""]), rng.choice([phone, ""]), email, "", "")
+    if op == 4: return "delete_contact", (c_id,)
+    if op == 5: return "toggle_favorite", (c_id,)
+    if op == 6: return "create_group", (rng.choice(GROUP_NAMES), "")
+    if op == 7: return "update_group", (g_id, rng.choice(GROUP_NAMES + [""]), "mô tả")
+    if op == 8: return ("delete_group", (g_id,)) if rng.random() < 0.3 else ("assign_contact_to_group", (c_id, g_id))
+    if op == 9: return "assign_contact_to_group", (c_id, g_id)
+    if op == 10: return "remove_contact_from_group", (c_id, g_id)
+    return "merge_contacts", (c_id, rng.sample(ids, min(2, len(ids))))
+
+
+def random_change(s, ref, rng, label):
+    # One change made to both; they must answer the same
+    name, args = pick_change(s, rng)
+    got = getattr(s, name)(*args)
+    want = getattr(ref, name)(*args)
+    if got != want:
+        raise CheckFailed(f"{label}: {name}{args} returned\n  service: {got!r}\n  reference: {want!r}")
+    if name == "add_contact" and got[0]:
+        # The clock is the one thing the reference cannot know
+        added = s.get_contact_by_id(ref.contacts[-1].contact_id)
+        if added is not None: ref.contacts[-1].created_at = added.created_at
+
+
+def seed_data(data_dir, rng):
+    # Files another tool could have written: numbers saved in several spellings
+    # (contacts sharing a phone key) and relations to missing contacts and groups
+    contacts = [Contact(i, rng.choice(NAMES), spelling(rng.randrange(12), rng), rng.choice(["", "an@gmail.com"]),
+                        "", "", rng.random() < 0.2, f"2024-01-{i:02d} 10:00:00") for i in range(1, 21)]
+    groups = [Group(1, "Gia đình", ""), Group(2, "VIP", "")]
+    relations = sorted({(rng.randrange(1, 23), rng.randrange(1, 4)) for _ in range(12)})
+    TextFileBackend(data_dir).save(contacts, groups, relations)
+    return Reference(contacts, groups, relations)
+
+
+def random_reads(s, rng):
+    # Keep every lazy index, ordering and cached result in use while changes happen
+    s.get_all_contacts(rng.choice(list(SORT_MODES)))
+    s.search_contact(rng.choice(KEYWORDS), rng.choice([None, 2]))
+    s.get_contacts_in_group(rng.choice([g.group_id for g in s.groups] or [1]))
+    s.snapshot_view()
+
+
+def open_service(data_dir, mode):
+    return PhoneBookService(storage=TextFileBackend(data_dir, use_journal=(mode == "journal")),
+                            write_behind=(mode == "write_behind"))
+
+
+def reloaded(s, data_dir, mode):
+    s.flush()
+    fresh = open_service(data_dir, "journal" if mode == "journal" else "plain")
+    try:
+        return describe(fresh)
+    finally:
+        fresh.close()
+
+
+def run_seed(seed, ops, every):
+    mode = MODES[(seed - 1) % len(MODES)]
+    rng = random.Random(seed)
+    data_dir = tempfile.mkdtemp(prefix="phonebook-check-")
+    ref = seed_data(data_dir, rng)
+    s = open_service(data_dir, mode)
+    try:
+        compare(f"seed {seed} ({mode}) loaded", describe(s), expected(ref), ("service", "reference"))
+        for step in range(1, ops + 1):
+            label = f"seed {seed} ({mode}) step {step}"
+            if rng.random() < 0.1:
+                # A failing transaction undoes everything done inside it
+                before = describe(s)
+                saved = copy.deepcopy(ref)
+                try:
+                    with s.transaction():
+                        for _ in range(rng.randrange(1, 5)): random_change(s, ref, rng, label)
+                        raise _Abort()
+                except _Abort:
+                    pass
+                ref = saved
+                compare(label + ", rolled back", describe(s), before, ("after", "before"))
+            elif rng.random() < 0.1:
+                with s.transaction():
+                    for _ in range(rng.randrange(1, 5)): random_change(s, ref, rng, label)
+            else:
+                random_change(s, ref, rng, label)
+            random_reads(s, rng)
+            if step % every == 0 or step == ops:
+                got = describe(s)
+                compare(label, got, expected(ref), ("service", "reference"))
+                compare(label, got, reloaded(s, data_dir, mode))
+    finally:
+        s.close()
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return mode
+
+
+def check_edge_cases():
+    data_dir = tempfile.mkdtemp(prefix="phonebook-check-")
+    s = open_service(data_dir, "plain")
+    try:
+        # Renaming the only contact of a built name ordering
+        s.add_contact("Bob", "0901000001", "", "", "")
+        s.get_all_contacts("name_asc")
+        s.update_contact(1, "Alice", "0901000001", "", "", "")
+        if _ids(s.get_all_contacts("name_asc")) != [1]: raise CheckFailed("renamed contact left the name ordering")
+        if s.get_contacts_page("name_desc")[1] != 1: raise CheckFailed("name ordering lost its total after a rename")
+        # Zero limits
+        if s.get_contacts_after("id", None, 0) != ([], None): raise CheckFailed("get_contacts_after with limit 0")
+        if s.search_contact("alice", 0) or s.search_contact("ali", 0): raise CheckFailed("search_contact with limit 0")
+    finally:
+        s.close()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Randomized PhoneBookService consistency checks")
+    parser.add_argument("--seeds", type=int, default=6, help="run seeds 1..N")
+    parser.add_argument("--ops", type=int, default=400, help="random operations per seed")
+    parser.add_argument("--every", type=int, default=25, help="compare with the reference and a reload every N operations")
+    args = parser.parse_args(argv)
+    try:
+        check_edge_cases()
+        print("edge cases: ok")
+        for seed in range(1, args.seeds + 1):
+            mode = run_seed(seed, args.ops, args.every)
+            print(f"seed {seed} ({mode}): {args.ops} operations ok")
+    except CheckFailed as e:
+        print(f"FAILED: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+# server.py
+# Line-delimited JSON server over TCP or a Unix socket, so other local programs
+# can resolve caller IDs and search contacts without the console menu.
+#
+#   python server.py --port 8765
+#   python server.py --unix /tmp/phonebook.sock --backend sqlite
+#
+# One request per line:   {"id": 1, "op": "get_contact_by_phone", "params": {"phone": "0901234567"}}
+# One response per line:  {"id": 1, "ok": true, "result": {...}}
+#                         {"id": 1, "ok": false, "error": "Error: Contact not found."}
+# Requests on one connection are answered in order. Lookups run directly on the
+# event loop; changes are queued to a single writer task that applies and
+# persists them on a worker thread, so the loop never waits on the disk.
+# Changes other programs make to the data are read by a watch thread.
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from services import PhoneBookService, DATA_DIR, CONTACT_PAGE_SIZE
+from storage import open_backend
+from models import contact_dict, group_dict
+
+DEFAULT_PORT = 8765
+# Longest request line accepted
+MAX_LINE_BYTES = 1 << 20
+# Queued changes handed to the worker thread in one go
+WRITE_BATCH_SIZE = 256
+# Default cap on contacts returned by "search" and "contacts_in_group"
+RESULT_LIMIT = 100
+
+
+def _contacts_page(s, p):
+    contacts, total = s.get_contacts_page(p.get("sort_by", "id"), int(p.get("offset", 0)),
+                                          int(p.get("limit", CONTACT_PAGE_SIZE)))
+    return {"contacts": [contact_dict(c) for c in contacts], "total": total}
+
+
+def _query(s, p):
+    # {"favorite": true, "group_ids": [3], "created_from": "2024-01-01", "text": "tran", "sort_by": "created_desc"}
+    q = s.query().order_by(p.get("sort_by", "id")).limit(int(p.get("limit", RESULT_LIMIT)))
+    if "favorite" in p: q.favorites(p["favorite"])
+    for g_id in p.get("group_ids", ()): q.in_group(int(g_id))
+    if "created_from" in p or "created_to" in p: q.created_between(p.get("created_from"), p.get("created_to"))
+    if p.get("text"): q.matching(p["text"])
+    return [contact_dict(c) for c in q.all()]
+
+
+# op -> handler(service, params) returning the JSON result
+READ_OPS = {
+    "get_contact": lambda s, p: contact_dict(s.get_contact_by_id(int(p["id"]))),
+    "get_contact_by_phone": lambda s, p: contact_dict(s.get_contact_by_phone(p["phone"])),
+    "search": lambda s, p: [contact_dict(c) for c in s.search_contact(p["keyword"], int(p.get("limit", RESULT_LIMIT)))],
+    "list_contacts": _contacts_page,
+    "get_groups": lambda s, p: [group_dict(g) for g in s.get_all_groups()],
+    "get_group": lambda s, p: group_dict(s.get_group_by_id(int(p["id"]))),
+    "groups_of_contact": lambda s, p: [group_dict(g) for g in s.get_groups_of_contact(int(p["id"]))],
+    "contacts_in_group": lambda s, p: [contact_dict(c) for c in s.get_contacts_in_group(int(p["id"]), int(p.get("limit", RESULT_LIMIT)))],
+    "group_member_count": lambda s, p: s.get_group_member_count(int(p["id"])),
+    "query": _query,
+    "stats": lambda s, p: s.get_stats(),
+}
+
+# op -> handler(service, params) returning the service's (ok, message) / bool
+WRITE_OPS = {
+    "add_contact": lambda s, p: s.add_contact(p.get("full_name", ""), p["phone"], p.get("email", ""),
+                                              p.get("address", ""), p.get("note", "")),
+    "update_contact": lambda s, p: s.update_contact(int(p["id"]), p.get("full_name", ""), p.get("phone", ""),
+                                                    p.get("email", ""), p.get("address", ""), p.get("note", "")),
+    "delete_contact": lambda s, p: s.delete_contact(int(p["id"])),
+    "toggle_favorite": lambda s, p: s.toggle_favorite(int(p["id"])),
+    "create_group": lambda s, p: s.create_group(p["name"], p.get("description", "")),
+    "update_group": lambda s, p: s.update_group(int(p["id"]), p.get("name", ""), p.get("description", "")),
+    "delete_group": lambda s, p: s.delete_group(int(p["id"])),
+    "assign_contact_to_group": lambda s, p: s.assign_contact_to_group(int(p["contact_id"]), int(p["group_id"])),
+    "remove_contact_from_group": lambda s, p: s.remove_contact_from_group(int(p["contact_id"]), int(p["group_id"])),
+}
+
+
+def _run_write(service, op, params):
+    # -> response fields for one change
+    try:
+        result = WRITE_OPS[op](service, params)
+    except KeyError as e:
+        return {"ok": False, "error": f"Error: Missing parameter {e}."}
+    except (AttributeError, TypeError, ValueError) as e:
+        # e.g. a number where the op expects text
+        return {"ok": False, "error": f"Error: {e}"}
+    if not isinstance(result, tuple):
+        result = (True, "Success: Done.") if result else (False, "Error: Not found.")
+    ok, msg = result
+    return {"ok": True, "result": msg} if ok else {"ok": False, "error": msg}
+
+
+class PhoneBookServer:
+    def __init__(self, service):
+        self.service = service
+        self._queue = None
+        self._writer = None
+        # Set while the worker thread holds the service's write lock: reads
+        # then wait on a pool thread instead of blocking the loop
+        self._writing = False
+        self._write_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="phonebook-writer")
+
+    # --- REQUESTS ---
+    async def handle(self, request):
+        # One decoded request -> one response dict
+        if not isinstance(request, dict):
+            return {"id": None, "ok": False, "error": "Error: Request must be a JSON object."}
+        req_id = request.get("id")
+        op = request.get("op")
+        params = request.get("params") or {}
+        if not isinstance(params, dict):
+            return {"id": req_id, "ok": False, "error": "Error: params must be a JSON object."}
+        if op in READ_OPS:
+            try:
+                if self._writing:
+                    loop = asyncio.get_running_loop()
+                    result = await loop.run_in_executor(None, READ_OPS[op], self.service, params)
+                else:
+                    result = READ_OPS[op](self.service, params)
+            except KeyError as e:
+                return {"id": req_id, "ok": False, "error": f"Error: Missing parameter {e}."}
+            except (AttributeError, TypeError, ValueError) as e:
+                return {"id": req_id, "ok": False, "error": f"Error: {e}"}
+            return {"id": req_id, "ok": True, "result": result}
+        if op in WRITE_OPS:
+            future = asyncio.get_running_loop().create_future()
+            await self._queue.put((op, params, future))
+            response = await future
+            response["id"] = req_id
+            return response
+        return {"id": req_id, "ok": False, "error": f"Error: Unknown op '{op}'."}
+
+    async def _write_loop(self):
+        # The single writer: drain what is queued and apply it on the worker thread
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < WRITE_BATCH_SIZE and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            self._writing = True
+            try:
+                responses = await loop.run_in_executor(self._write_pool, self._apply_batch, batch)
+            except Exception as e:
+                responses = [{"ok": False, "error": f"Error: {e}"}] * len(batch)
+            finally:
+                self._writing = False
+            for (_, _, future), response in zip(batch, responses):
+                if not future.done(): future.set_result(dict(response))
+                self._queue.task_done()
+
+    def _apply_batch(self, batch):
+        # One transaction per batch: the changes reach the disk in one write
+        with self.service.transaction():
+            return [_run_write(self.service, op, params) for op, params, _ in batch]
+
+    # --- CONNECTIONS ---
+    async def _serve_client(self, reader, writer):
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    writer.write(b'{"id": null, "ok": false, "error": "Error: Request line too long."}\n')
+                    break
+                if not line: break
+                if not line.strip(): continue
+                try:
+                    response = await self.handle(json.loads(line))
+                except ValueError:
+                    response = {"id": None, "ok": False, "error": "Error: Invalid JSON."}
+                writer.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+                # Only waits when the client is not reading its responses
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=DEFAULT_PORT, unix_path=None):
+        self._queue = asyncio.Queue()
+        self._writer = asyncio.create_task(self._write_loop())
+        if unix_path:
+            return await asyncio.start_unix_server(self._serve_client, unix_path, limit=MAX_LINE_BYTES)
+        return await asyncio.start_server(self._serve_client, host, port, limit=MAX_LINE_BYTES)
+
+    async def stop(self):
+        # Let queued changes finish, then stop the writer
+        if self._queue is not None: await self._queue.join()
+        if self._writer is not None: self._writer.cancel()
+        self._write_pool.shutdown(wait=True)
+
+
+async def serve(service, host, port, unix_path=None):
+    # Build the search index up front so the first searches are not slow
+    service.warm_indexes()
+    # Reads run on the loop: changes other programs save are picked up (and the
+    # indexes rebuilt) by the watch thread, never by a read
+    service.watch()
+    app = PhoneBookServer(service)
+    server = await app.start(host, port, unix_path)
+    where = unix_path or "%s:%d" % (host, port)
+    print(f"PhoneBook server listening on {where} ({len(service.contacts)} contacts)", file=sys.stderr, flush=True)
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows: Ctrl+C raises KeyboardInterrupt instead
+    try:
+        async with server:
+            await stop.wait()
+    finally:
+        await app.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PhoneBook line-JSON server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", metavar="PATH", help="listen on a Unix socket instead of TCP")
+    parser.add_argument("--data", default=DATA_DIR, help="data folder")
+    parser.add_argument("--backend", choices=("text", "sqlite"), default="text")
+    parser.add_argument("--no-journal", action="store_true",
+                        help="rewrite the text files on every change instead of appending to the journal")
+    parser.add_argument("--stats", action="store_true", help="collect timings, readable with the 'stats' op")
+    args = parser.parse_args(argv)
+
+    service = PhoneBookService(storage=open_backend(args.backend, args.data, use_journal=not args.no_journal),
+                               instrument=args.stats)
+    try:
+        asyncio.run(serve(service, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Stops the watch thread and closes the storage cleanly
+        service.close()
+        if args.unix and os.path.exists(args.unix): os.remove(args.unix)
+
+
+if __name__ == "__main__":
+    main()
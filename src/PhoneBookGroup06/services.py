@@ -1,249 +1,1247 @@
 # services.py
 import os
 import re
+import atexit
+import gc
+import io
+import csv
+import gzip
+import json
+import time
+import functools
+import operator
+import threading
+import contextlib
+from collections import deque
+from types import SimpleNamespace
+from concurrent.futures import ProcessPoolExecutor
+from heapq import nsmallest
+from itertools import islice
 
-# --- SYSTEM PATH CONFIG ---
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.path.join(BASE_DIR, "data")
-CONTACT_FILE = os.path.join(DATA_DIR, "contacts.txt")
-GROUP_FILE = os.path.join(DATA_DIR, "groups.txt")
-RELATION_FILE = os.path.join(DATA_DIR, "contact_group.txt")
+# Bulk import: rows validated together per batch
+IMPORT_BATCH_SIZE = 5000
+# Files this big are parsed by worker processes, in line-aligned byte ranges of
+# about PARALLEL_CHUNK_BYTES; each worker keeps this many ranges queued
+PARALLEL_IMPORT_MIN_BYTES = 64 << 20
+PARALLEL_CHUNK_BYTES = 4 << 20
+PARALLEL_QUEUE_PER_WORKER = 2
+# Streaming export: rows formatted into one string per write
+EXPORT_CHUNK_ROWS = 4096
+EXPORT_FORMATS = ("txt", "csv", "jsonl")
+EXPORT_COLUMNS = ["ID", "FullName", "Phone", "Email", "Address", "Note", "Favorite", "CreatedAt"]
 
-if not os.path.exists(DATA_DIR):
-    os.makedirs(DATA_DIR)
+# Listing orders: sort_by -> (ordering, descending)
+SORT_MODES = {"id": ("id", False), "name_asc": ("name", False), "name_desc": ("name", True),
+              "created_asc": ("created", False), "created_desc": ("created", True)}
+CONTACT_PAGE_SIZE = 20
 
-from models import Contact, Group
+# Timed when the service is created with instrument=True
+INSTRUMENTED_METHODS = ("load_system_data", "save_system_data", "get_all_contacts", "get_contacts_page",
+                        "get_contacts_after", "get_contact_by_id", "get_contact_by_phone", "add_contact",
+                        "update_contact", "delete_contact", "toggle_favorite", "search_contact",
+                        "get_all_groups", "get_group_by_id", "create_group", "update_group", "delete_group",
+                        "get_groups_of_contact", "get_contacts_in_group", "assign_contact_to_group",
+                        "remove_contact_from_group", "export_contacts_to_file", "import_contacts_from_file",
+                        "find_duplicates", "merge_contacts", "merge_duplicates", "run_query")
+
+# Write-behind mode: changes are written once they pause for WRITE_BEHIND_DELAY
+# seconds, or WRITE_BEHIND_MAX_WAIT seconds after the first of a steady stream
+WRITE_BEHIND_DELAY = 0.2
+WRITE_BEHIND_MAX_WAIT = 2.0
+
+# Read results reused until the next change: entries, approximate bytes held
+RESULT_CACHE_SIZE = 256
+RESULT_CACHE_BYTES = 64 << 20
+
+EMAIL_PATTERN = re.compile(r"^[\w\.-]+@[\w\.-]+\.\w+$")
+
+# Reads look for changes committed by other processes at most this often (seconds);
+# writes always look first
+STALE_CHECK_INTERVAL = 1.0
+# watch(): seconds between looks at the data files
+WATCH_INTERVAL = 0.5
+
+from models import Contact, Group, now_timestamp, name_sort_key, query_key, canonical_phone, search_fields
+from indexes import RelationStore, NGramIndex, SortedIndex, KeyIndex
+from dedupe import find_clusters
+from query import Query, plan_query, execute
+from cache import ResultCache
+from views import build_view, VIEW_CHUNK
+from storage import TextFileBackend, DATA_DIR, JOURNAL_COMPACT_LIMIT, ALL_SECTIONS, CONTACTS, GROUPS, RELATIONS, touched_sections
+from instrumentation import ServiceStats, instrument
+from locking import RWLock
+
+_contact_id = operator.attrgetter("contact_id")
+
+def _phone_index(contacts):
+    # canonical_phone() -> contact, see PhoneBookService._contact_by_phone
+    index = KeyIndex(_contact_id)
+    index.build([canonical_phone(c.phone_number) for c in contacts], list(contacts))
+    return index
+
+# --- LOCKING ---
+# Public methods run under the service's RWLock: readers share it, a writer holds
+# it alone together with the storage file lock, so threads and processes sharing
+# one data folder take turns. Before writing, the service reloads if another
+# process committed since its last load/save, then persists while still locked.
+def _reads(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        lock = self._lock
+        # With watch() running, its thread does this in the background
+        if self._watcher is None and time.monotonic() >= self._next_stale_check and not lock.held():
+            self.refresh()
+        lock.acquire_read()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            lock.release_read()
+    return wrapper
+
+def _writes(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._exclusive() as outermost:
+            if outermost and self._is_stale(): self._load()
+            return method(self, *args, **kwargs)
+    return wrapper
+
+# Changes that reach the disk only through _commit(): with write-behind they just
+# queue records, so they skip the storage lock (see PhoneBookService._changing)
+def _changes(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._changing():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+# --- IMPORT PARSING ---
+# Field splitting and validation only: duplicate checks and ids need the service
+# and happen in one place (_add_imported), so serial and parallel imports agree.
+def _parse_import_lines(lines):
+    # -> (rows, [(name, phone, email, phone_key)], invalid rows)
+    valid = []
+    invalid = 0
+    for line in lines:
+        p = line.strip().split("|")
+        if len(p) < 3 or not p[2]:
+            if line.strip(): invalid += 1
+            continue
+        email = p[3] if len(p) > 3 else ""
+        if email and not EMAIL_PATTERN.match(email):
+            invalid += 1
+            continue
+        valid.append((p[1], p[2], email, canonical_phone(p[2])))
+    return len(lines), valid, invalid
+
+def _read_import_batches(file_path, batch_size):
+    with open(file_path, "r", encoding="utf-8") as f:
+        first = f.readline()
+        batch = [] if "ID|" in first else [first]
+        for line in f:
+            batch.append(line)
+            if len(batch) < batch_size: continue
+            yield _parse_import_lines(batch)
+            batch = []
+        if batch: yield _parse_import_lines(batch)
+
+def _line_ranges(file_path, start, chunk_bytes):
+    # [start, end) byte ranges that each end on a line break
+    size = os.path.getsize(file_path)
+    ranges = []
+    with open(file_path, "rb") as f:
+        while start < size:
+            end = start + chunk_bytes
+            if end < size:
+                f.seek(end - 1)
+                f.readline()
+                end = f.tell()
+            else:
+                end = size
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+def _parse_import_range(file_path, start, end):
+    # Runs in a worker process
+    with open(file_path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    # Same line splitting as reading the file in text mode
+    return _parse_import_lines(list(io.TextIOWrapper(io.BytesIO(data), encoding="utf-8")))
+
+def _parallel_import_batches(file_path, workers):
+    with open(file_path, "rb") as f:
+        first = f.readline()
+    ranges = _line_ranges(file_path, len(first) if b"ID|" in first else 0, PARALLEL_CHUNK_BYTES)
+    with ProcessPoolExecutor(workers) as pool:
+        # Results are handed back in file order; only a few ranges are parsed ahead
+        queued = deque()
+        for start, end in ranges:
+            queued.append(pool.submit(_parse_import_range, file_path, start, end))
+            if len(queued) >= workers * PARALLEL_QUEUE_PER_WORKER: yield queued.popleft().result()
+        while queued: yield queued.popleft().result()
+
+# --- RESULT CACHE ---
+# For @_reads methods returning a list: the result is kept per (method, arguments)
+# until the data version changes, and every caller gets its own copy of the list.
+def _cached(method):
+    name = method.__name__
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        cache = self._cache
+        if cache is None: return method(self, *args, **kwargs)
+        key = (name, args, tuple(sorted(kwargs.items())))
+        version = self._version
+        try:
+            result = cache.get(key, version)
+        except TypeError:  # unhashable arguments
+            return method(self, *args, **kwargs)
+        if result is None:
+            result = tuple(method(self, *args, **kwargs))
+            cache.put(key, version, result)
+        return list(result)
+    return wrapper
 
 class PhoneBookService:
-    def __init__(self):
+    # storage: any storage.StorageBackend; defaults to the text files in data_dir.
+    # instrument: record call latencies and counters, read them with get_stats().
+    def __init__(self, data_dir=DATA_DIR, use_journal=False, journal_limit=JOURNAL_COMPACT_LIMIT, storage=None,
+                 instrument=False, cache_size=RESULT_CACHE_SIZE, cache_bytes=RESULT_CACHE_BYTES, write_behind=False):
+        # write_behind: changes return once applied in memory and a background
+        # thread persists them; flush() waits for the disk, close() flushes for good
         self.contacts = []
         self.groups = []
-        self.relations = [] 
+        self.relations = RelationStore()
+        self.relations.changed_groups = set()
+        # Hash indexes for the hot lookups, kept in sync by the _insert/_remove helpers
+        self._contact_by_id = {}
+        # Keyed by canonical_phone(), so "+84 912..." and "0912..." are one number;
+        # data saved before that may have several contacts under one key
+        self._contact_by_phone = _phone_index(())
+        self._group_by_id = {}
+        self._group_by_name = {}
+        self._favorite_ids = set()
+        self._next_contact_id = 1
+        self._next_group_id = 1
+        # Built on the first search, then maintained incrementally
+        self._search_index = None
+        # Sorted orderings ("id", "name", "created"), also built on first use
+        self._orders = {}
+        # Inside transaction(): records waiting for the commit, and the undo steps
+        # (method, args) that put the indexes back on rollback
+        self._txn = None
+        self._txn_save = None
+        self._undo = None
+        # Sections (storage.CONTACTS/GROUPS/RELATIONS) changed without a record,
+        # written by the next save_system_data()
+        self._dirty = set()
+        # Serializes lazy index builds between concurrent readers
+        self._build_lock = threading.Lock()
+        self._lock = RWLock()
+        # storage.signature() as of our last load/save
+        self._signature = None
+        self._next_stale_check = 0.0
+        # Bumped by every change; cached results from older versions are dropped
+        self._version = 0
+        self._cache = ResultCache(cache_size, cache_bytes) if cache_size else None
+        # Last snapshot_view() and what changed since: contact id chunks, groups, member sets
+        self._view = None
+        self._changed_chunks = set()
+        self._groups_changed = False
+        # Write-behind: committed records the writer thread has not persisted yet
+        self._pending = []
+        # One flush() at a time; _writing is set while it writes without the write lock
+        self._flush_lock = threading.Lock()
+        self._writing = False
+        self._writer = None
+        self._writer_wake = threading.Condition()
+        self._last_change = 0.0
+        self._closing = False
+        # Last error of a background write (the changes stay queued)
+        self.write_error = None
+        # watch(): thread picking up changes made by other programs
+        self._watcher = None
+        self._watch_stop = threading.Event()
+        self.watch_error = None
+        self.storage = storage or TextFileBackend(data_dir, use_journal, journal_limit)
+        self.stats = None
+        if instrument: self._enable_instrumentation()
         self.load_system_data()
+        if write_behind: self._start_write_behind()
 
     # --- HELPER: DATA PERSISTENCE ---
     def load_system_data(self):
-        self.contacts.clear(); self.groups.clear(); self.relations.clear()
-        
-        if os.path.exists(CONTACT_FILE):
-            with open(CONTACT_FILE, "r", encoding="utf-8") as f:
-                for line in f:
-                    p = line.strip().split("|")
-                    if len(p) >= 3:
-                        c = Contact(int(p[0]), p[1], p[2], p[3], p[4], p[5], p[6]=="True", p[7])
-                        self.contacts.append(c)
-        
-        if os.path.exists(GROUP_FILE):
-            with open(GROUP_FILE, "r", encoding="utf-8") as f:
-                for line in f:
-                    p = line.strip().split("|")
-                    if len(p) >= 2:
-                        self.groups.append(Group(int(p[0]), p[1], p[2] if len(p)>2 else ""))
-        
-        if os.path.exists(RELATION_FILE):
-             with open(RELATION_FILE, "r", encoding="utf-8") as f:
-                for line in f:
-                    p = line.strip().split("|")
-                    if len(p) == 2:
-                        self.relations.append((int(p[0]), int(p[1])))
-
-    def save_system_data(self):
-        with open(CONTACT_FILE, "w", encoding="utf-8") as f:
-            for c in self.contacts:
-                f.write(f"{c.contact_id}|{c.full_name}|{c.phone_number}|{c.email}|{c.address}|{c.note}|{c.is_favorite}|{c.created_at}\n")
-        with open(GROUP_FILE, "w", encoding="utf-8") as f:
-            for g in self.groups:
-                f.write(f"{g.group_id}|{g.group_name}|{g.description}\n")
-        with open(RELATION_FILE, "w", encoding="utf-8") as f:
-            for r in self.relations:
-                f.write(f"{r[0]}|{r[1]}\n")
+        with self._exclusive():
+            self._load()
+
+    def _prepare_load(self, loaded=None, warm=False):
+        # Read the data and build the costly structures without touching the service,
+        # so watch() can do it while readers carry on. loaded: storage.load() result.
+        # warm: also build the search index and orderings the service has built now,
+        # so no read has to rebuild them after the swap
+        # Loading allocates millions of small objects and none of them form cycles:
+        # pause the cyclic GC instead of letting it rescan everything repeatedly
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            contacts, groups, relations, pending = loaded or self.storage.load()
+            relations = RelationStore(relations)
+            by_phone = _phone_index(contacts)
+            search_index, orders = None, {}
+            if warm:
+                if self._search_index is not None:
+                    search_index = NGramIndex()
+                    search_index.build((c.contact_id, self._search_fields(c)) for c in contacts)
+                for kind in list(self._orders):
+                    orders[kind] = SortedIndex((self._order_key(kind, c), c.contact_id) for c in contacts)
+        finally:
+            if gc_enabled: gc.enable()
+        return contacts, groups, relations, by_phone, pending, (search_index, orders)
+
+    def _load(self, prepared=None):
+        # prepared: a _prepare_load() result, when the data was read ahead of time
+        if prepared is None: prepared = self._prepare_load()
+        contacts, groups, relations, by_phone, pending, (search_index, orders) = prepared
+        self._version += 1
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self.contacts[:] = contacts
+            self.groups[:] = groups
+            relations.changed_groups = set()
+            self.relations = relations
+            self._rebuild_indexes(by_phone)
+            self._search_index, self._orders = search_index, orders
+            for record in pending: self._apply_record(record)
+            # Changes still waiting for the write-behind thread go on top
+            if self._pending: self._rebase_pending()
+        finally:
+            if gc_enabled: gc.enable()
+        # Journal left behind by a journal-mode session: fold it into the files
+        if pending and not self.storage.journaled:
+            self._save()
+
+    @_writes
+    def save_system_data(self, full=False):
+        # Writes the dirty sections only; full=True rewrites everything. With nothing
+        # dirty it writes everything too, for callers that changed the lists directly
+        self._save(full or not (self._dirty or self._pending or self._txn))
+
+    def _save(self, full=False):
+        # save_system_data() without the nothing-dirty rule, for saves that must not
+        # rewrite untouched files (the storage adds the sections its journal changed)
+        if self._txn is not None:
+            # Inside transaction(): one save at the commit covers everything
+            self._txn_save = full or bool(self._txn_save)
+            return
+        # Also covers changes waiting for the write-behind thread
+        records, self._pending = self._pending, []
+        sections = ALL_SECTIONS if full else self._dirty | touched_sections(records)
+        self._dirty = set()
+        written = self.storage.save(self.contacts, self.groups, self.relations, sections)
+        if self.stats is not None and written: self.stats.count("save_system_data.bytes_written", written)
+
+    @contextlib.contextmanager
+    def _exclusive(self):
+        # Write lock + storage lock; yields True for the outermost (non-nested) holder.
+        # Nested holders take the (reentrant) storage lock too: the outer one may be
+        # a write-behind change holding only the write lock
+        lock = self._lock
+        lock.acquire_write()
+        try:
+            with self.storage.locked():
+                yield lock.write_depth == 1
+                self._mark_fresh()
+        finally:
+            lock.release_write()
+
+    @contextlib.contextmanager
+    def _changing(self):
+        # _exclusive() for @_changes methods. Nested in a transaction they only need
+        # the write lock, and so do write-behind changes: they queue records and a
+        # flush() writing meanwhile holds the storage lock without blocking them
+        lock = self._lock
+        if self._writer is None and not lock.write_depth:
+            with self._exclusive():
+                if self._is_stale(): self._load()
+                yield
+            return
+        lock.acquire_write()
+        try:
+            if lock.write_depth == 1 and self._is_stale():
+                with self.storage.locked():
+                    if self._is_stale(): self._load()
+                    self._mark_fresh()
+            yield
+        finally:
+            lock.release_write()
+
+    def _mark_fresh(self):
+        self._signature = self.storage.signature()
+        self._next_stale_check = time.monotonic() + STALE_CHECK_INTERVAL
+
+    def _is_stale(self):
+        # Not while flush() is writing our own changes
+        if self._writing: return False
+        sig = self.storage.signature()
+        return sig is not None and sig != self._signature
+
+    def refresh(self):
+        # Pick up changes another process committed; -> True if there were any.
+        # Lines appended to the data files are read alone, anything else reloads all.
+        self._next_stale_check = time.monotonic() + STALE_CHECK_INTERVAL
+        if not self._is_stale(): return False
+        with self._exclusive():
+            if not self._is_stale(): return False
+            # Queued write-behind changes are rebased by a full load
+            changes = None if self._pending else self.storage.load_changes()
+            if changes is None: self._load()
+            else: self._apply_changes(*changes)
+            return True
+
+    def _apply_changes(self, contacts, groups, relations, records):
+        # Appended lines, added the way _load() would have read them
+        self._version += 1
+        for c in contacts: self._insert_contact(c)
+        for g in groups: self._insert_group(g)
+        for c_id, g_id in relations: self.relations.add(c_id, g_id)
+        for record in records: self._apply_record(record)
+
+    # --- WATCH MODE ---
+    def watch(self, interval=WATCH_INTERVAL):
+        # Follow changes other programs make to the data in a background thread.
+        # Reads then stop checking the files themselves and never wait for a reload,
+        # except for the short moment new data is swapped in.
+        if self._watcher is not None: return
+        self._watch_stop.clear()
+        self._watcher = threading.Thread(target=self._watch_loop, args=(interval,), name="phonebook-watch", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        if self._watcher is None: return
+        self._watch_stop.set()
+        self._watcher.join()
+        self._watcher = None
+
+    def _watch_loop(self, interval):
+        while not self._watch_stop.wait(interval):
+            try:
+                self._poll_changes()
+                self.watch_error = None
+            except Exception as e:
+                self.watch_error = e
+
+    def _poll_changes(self):
+        if not self._is_stale(): return False
+        if self._pending: return self.refresh()
+        # Read the changes holding only the storage lock, so readers carry on meanwhile
+        with self.storage.locked():
+            signature = self.storage.signature()
+            changes = self.storage.load_changes()
+            loaded = self.storage.load() if changes is None else None
+        prepared = self._prepare_load(loaded, warm=True) if loaded else None
+        with self._exclusive():
+            # A write in the meantime found the data stale and reloaded it, changes included
+            if not self._is_stale(): return False
+            if self.storage.signature() != signature: self._load()  # changed again, read it all now
+            elif changes is not None: self._apply_changes(*changes)
+            else: self._load(prepared)
+        return True
+
+    # --- HELPER: INSTRUMENTATION ---
+    def _enable_instrumentation(self):
+        self.stats = ServiceStats()
+        instrument(self, INSTRUMENTED_METHODS, self.stats)
+        instrument(self.storage, ("load", "save", "apply"), self.stats, prefix="storage.")
+
+    @_reads
+    def warm_indexes(self):
+        # Build the lazy search index and orderings now instead of on first use
+        self._get_search_index()
+        for kind, _ in set(SORT_MODES.values()): self._get_order(kind)
+
+    def get_stats(self):
+        if self.stats is None: return {"enabled": False}
+        stats = self.stats.snapshot()
+        stats["enabled"] = True
+        stats["storage"] = type(self.storage).__name__
+        stats["contacts"] = len(self.contacts)
+        stats["cache"] = self.cache_info()
+        return stats
+
+    def cache_info(self):
+        # Hit/miss counts and size of the result cache
+        return self._cache.info() if self._cache is not None else {"enabled": False}
+
+    # --- HELPER: INDEXES ---
+    def _rebuild_indexes(self, by_phone=None):
+        self._contact_by_id = {c.contact_id: c for c in self.contacts}
+        if by_phone is None: by_phone = _phone_index(self.contacts)
+        self._contact_by_phone = by_phone
+        self._favorite_ids = {c.contact_id for c in self.contacts if c.is_favorite}
+        self._group_by_id = {g.group_id: g for g in self.groups}
+        self._group_by_name = {g.group_name.lower(): g for g in self.groups}
+        self._next_contact_id = max(self._contact_by_id, default=0) + 1
+        self._next_group_id = max(self._group_by_id, default=0) + 1
+        self._search_index = None
+        self._orders = {}
+        self._view = None
+
+    def _order_key(self, kind, c):
+        if kind == "name": return name_sort_key(c.full_name)
+        if kind == "created": return c.created_ts
+        return c.contact_id
+
+    def _get_order(self, kind):
+        order = self._orders.get(kind)
+        if order is None:
+            with self._build_lock:
+                order = self._orders.get(kind)
+                if order is None:
+                    order = SortedIndex((self._order_key(kind, c), c.contact_id) for c in self.contacts)
+                    self._orders[kind] = order
+        return order
+
+    def _get_search_index(self):
+        if self._search_index is not None: return self._search_index
+        with self._build_lock:
+            if self._search_index is not None: return self._search_index
+            gc_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                index = NGramIndex()
+                index.build((c.contact_id, self._search_fields(c)) for c in self.contacts)
+            finally:
+                if gc_enabled: gc.enable()
+            self._search_index = index
+            return index
+
+    # Normalized once per contact (on insert/update), never per query
+    def _search_fields(self, c):
+        return search_fields(c.full_name, c.phone_number, c.email)
+
+    def _insert_contact(self, c):
+        self.contacts.append(c)
+        self._index_contact(c)
+
+    def _index_contact(self, c):
+        self._contact_by_id[c.contact_id] = c
+        self._changed_chunks.add(c.contact_id // VIEW_CHUNK)
+        self._contact_by_phone.add(canonical_phone(c.phone_number), c)
+        if c.is_favorite: self._favorite_ids.add(c.contact_id)
+        if self._search_index is not None:
+            self._search_index.add(c.contact_id, self._search_fields(c))
+        for kind, order in self._orders.items():
+            order.add(self._order_key(kind, c), c.contact_id)
+        if c.contact_id >= self._next_contact_id:
+            self._next_contact_id = c.contact_id + 1
+        if self._undo is not None: self._undo.append((self._unindex_contact, (c,)))
+
+    def _remove_contact(self, c):
+        self.contacts.remove(c)
+        self._unindex_contact(c)
+
+    def _unindex_contact(self, c):
+        # _remove_contact without the O(n) list removal, for bulk deletes
+        del self._contact_by_id[c.contact_id]
+        self._changed_chunks.add(c.contact_id // VIEW_CHUNK)
+        self._contact_by_phone.remove(canonical_phone(c.phone_number), c)
+        self._favorite_ids.discard(c.contact_id)
+        if self._search_index is not None:
+            self._search_index.remove(c.contact_id)
+        for kind, order in self._orders.items():
+            order.remove(self._order_key(kind, c), c.contact_id)
+        if self._undo is not None: self._undo.append((self._index_contact, (c,)))
+
+    def _set_contact_fields(self, c, fields):
+        if self._undo is not None:
+            self._undo.append((self._set_contact_fields, (c, {k: getattr(c, k) for k in fields})))
+        self._changed_chunks.add(c.contact_id // VIEW_CHUNK)
+        if "phone_number" in fields: self._contact_by_phone.remove(canonical_phone(c.phone_number), c)
+        name_order = self._orders.get("name") if "full_name" in fields else None
+        if name_order is not None: name_order.remove(name_sort_key(c.full_name), c.contact_id)
+        for k, v in fields.items(): setattr(c, k, v)
+        if name_order is not None: name_order.add(name_sort_key(c.full_name), c.contact_id)
+        if "phone_number" in fields: self._contact_by_phone.add(canonical_phone(c.phone_number), c)
+        if c.is_favorite: self._favorite_ids.add(c.contact_id)
+        else: self._favorite_ids.discard(c.contact_id)
+        if self._search_index is not None and fields.keys() & {"full_name", "phone_number", "email"}:
+            self._search_index.update(c.contact_id, self._search_fields(c))
+
+    def _insert_group(self, g):
+        self.groups.append(g)
+        self._index_group(g)
+
+    def _index_group(self, g):
+        self._group_by_id[g.group_id] = g
+        self._groups_changed = True
+        self._group_by_name[g.group_name.lower()] = g
+        if g.group_id >= self._next_group_id:
+            self._next_group_id = g.group_id + 1
+        if self._undo is not None: self._undo.append((self._unindex_group, (g,)))
+
+    def _remove_group(self, g):
+        self.groups.remove(g)
+        self._unindex_group(g)
+
+    def _unindex_group(self, g):
+        del self._group_by_id[g.group_id]
+        self._groups_changed = True
+        if self._group_by_name.get(g.group_name.lower()) is g:
+            del self._group_by_name[g.group_name.lower()]
+        if self._undo is not None: self._undo.append((self._index_group, (g,)))
+
+    def _set_group_fields(self, g, fields):
+        if self._undo is not None:
+            self._undo.append((self._set_group_fields, (g, {k: getattr(g, k) for k in fields})))
+        self._groups_changed = True
+        if self._group_by_name.get(g.group_name.lower()) is g:
+            del self._group_by_name[g.group_name.lower()]
+        for k, v in fields.items(): setattr(g, k, v)
+        self._group_by_name[g.group_name.lower()] = g
+
+    # --- HELPER: MUTATION RECORDS ---
+    # Every change is described by one record, e.g. {"op": "contact_update", "id": 3, "fields": {...}},
+    # which the storage backend persists (journal line, SQL row write or full save)
+    # and _apply_record replays on load.
+    def _commit(self, *records):
+        if not records: return
+        self._version += 1
+        if self._txn is not None:
+            self._txn.extend(records)
+            return
+        if self._writer is not None:
+            self._pending.extend(records)
+            self._last_change = time.monotonic()
+            with self._writer_wake: self._writer_wake.notify()
+            return
+        self._apply_to_storage(records)
+
+    def _apply_to_storage(self, records, state=None):
+        # state: the contacts/groups/relations to save, by default the service's own
+        with self.storage.locked():
+            written = self.storage.apply(list(records), state or self)
+        if self.stats is not None and written: self.stats.count("commit.bytes_written", written)
+
+    # --- WRITE-BEHIND ---
+    def _start_write_behind(self):
+        self._writer = threading.Thread(target=self._write_behind_loop, name="phonebook-write-behind", daemon=True)
+        self._writer.start()
+        # Whatever is still queued when the program exits gets written then
+        atexit.register(self.close)
+
+    def _write_behind_loop(self):
+        wake = self._writer_wake
+        while True:
+            with wake:
+                while not self._pending and not self._closing: wake.wait()
+            # close() writes whatever is left itself
+            if self._closing: return
+            # Coalesce a burst of changes into one write
+            first = time.monotonic()
+            with wake:
+                while not self._closing:
+                    wait = min(self._last_change + WRITE_BEHIND_DELAY, first + WRITE_BEHIND_MAX_WAIT) - time.monotonic()
+                    if wait <= 0: break
+                    wake.wait(wait)
+            if self._closing: return
+            try:
+                self.flush()
+                self.write_error = None
+            except Exception as e:
+                # Changes stay queued: retry later, flush()/close() raise if it keeps failing
+                self.write_error = e
+                time.sleep(WRITE_BEHIND_DELAY)
+
+    def _rebase_pending(self):
+        # Replay queued changes on freshly loaded data. A contact or group they added
+        # whose id another process has used meanwhile moves to a new id, and the
+        # queued records referring to it follow.
+        contact_ids, group_ids = {}, {}
+        rebased = []
+        for record in self._pending:
+            record = dict(record)
+            op = record["op"]
+            if op == "contact_add":
+                if record["contact"]["contact_id"] in self._contact_by_id:
+                    contact_ids[record["contact"]["contact_id"]] = self._next_contact_id
+                    record["contact"] = dict(record["contact"], contact_id=self._next_contact_id)
+            elif op == "group_add":
+                if record["group"]["group_id"] in self._group_by_id:
+                    group_ids[record["group"]["group_id"]] = self._next_group_id
+                    record["group"] = dict(record["group"], group_id=self._next_group_id)
+            elif "id" in record:
+                ids = contact_ids if op.startswith("contact") else group_ids
+                record["id"] = ids.get(record["id"], record["id"])
+            else:
+                record["contact_id"] = contact_ids.get(record["contact_id"], record["contact_id"])
+                record["group_id"] = group_ids.get(record["group_id"], record["group_id"])
+            self._apply_record(record)
+            rebased.append(record)
+        self._pending = rebased
+
+    def flush(self):
+        # Returns once every change made so far is on disk (no-op without write-behind).
+        # The queue and the lists are taken under the write lock, which is let go
+        # before writing: reads and changes carry on while the disk works, only the
+        # storage lock is held
+        if self._lock.write_depth:
+            # Inside a change or transaction: write without letting go of anything
+            with self._exclusive():
+                records, self._pending = self._pending, []
+                try:
+                    self._apply_to_storage(records)
+                except BaseException:
+                    self._pending[:0] = records
+                    raise
+            return
+        with self._flush_lock:
+            records = None
+            try:
+                with contextlib.ExitStack() as storage_lock:
+                    self._lock.acquire_write()
+                    try:
+                        storage_lock.enter_context(self.storage.locked())
+                        if not self._pending: return
+                        # Another process saved meanwhile: reload under our changes instead of overwriting its
+                        if self._is_stale(): self._load()
+                        records, self._pending = self._pending, []
+                        # Copies of the lists the storage will write. The Contact and Group
+                        # objects are shared, so a change made while writing may already be
+                        # in the files; its records are queued and the next flush writes it anyway
+                        sections = self.storage.state_sections(records)
+                        state = SimpleNamespace(contacts=list(self.contacts) if CONTACTS in sections else (),
+                                                groups=list(self.groups) if GROUPS in sections else (),
+                                                relations=list(self.relations) if RELATIONS in sections else ())
+                        self._writing = True
+                    finally:
+                        self._lock.release_write()
+                    try:
+                        self._apply_to_storage(records, state)
+                        records = None
+                        self._mark_fresh()
+                    finally:
+                        self._writing = False
+            except BaseException:
+                # Not written: back to the front of the queue (after letting go of the storage lock)
+                if records:
+                    self._lock.acquire_write()
+                    try:
+                        self._pending[:0] = records
+                    finally:
+                        self._lock.release_write()
+                raise
+
+    def close(self):
+        # Stops the watch and write-behind threads, writes what is queued and closes the storage
+        self.stop_watching()
+        if self._writer is not None:
+            with self._writer_wake:
+                self._closing = True
+                self._writer_wake.notify()
+            self._writer.join()
+            self._writer = None
+            atexit.unregister(self.close)
+        self.flush()
+        self.storage.close()
+
+    # --- TRANSACTIONS ---
+    @contextlib.contextmanager
+    def transaction(self):
+        # with service.transaction(): ...
+        # Service calls inside the block validate and apply in memory as usual, but
+        # are persisted together once when it ends; an exception undoes all of them.
+        # Other threads wait for the whole block. Nested blocks join the outer one.
+        with self._changing():
+            if self._txn is not None:
+                yield self
+                return
+            saved = (list(self.contacts), list(self.groups), self._next_contact_id, self._next_group_id, set(self._dirty))
+            undo = []
+            self._txn, self._txn_save, self._undo = [], None, undo
+            self.relations.undo_log = undo
+            try:
+                yield self
+                records, save = self._txn, self._txn_save
+                self._end_transaction()
+                if save is None:
+                    self._commit(*records)
+                else:
+                    self._dirty |= touched_sections(records)
+                    self.save_system_data(full=save)
+            except BaseException:
+                self._end_transaction()
+                self._rollback(undo, saved)
+                raise
+
+    def _end_transaction(self):
+        self._txn = None
+        self._undo = None
+        self.relations.undo_log = None
+
+    def _rollback(self, undo, saved):
+        self._version += 1
+        for method, args in reversed(undo): method(*args)
+        self.contacts[:], self.groups[:], self._next_contact_id, self._next_group_id, self._dirty = saved
+
+    @_writes
+    def compact_journal(self):
+        self._save()
+
+    def _apply_record(self, record):
+        op = record["op"]
+        if op == "contact_add":
+            c = Contact(**record["contact"])
+            old = self._contact_by_id.get(c.contact_id)
+            if old: self._remove_contact(old)
+            self._insert_contact(c)
+        elif op == "contact_update":
+            c = self._contact_by_id.get(record["id"])
+            if c: self._set_contact_fields(c, record["fields"])
+        elif op == "contact_delete":
+            c = self._contact_by_id.get(record["id"])
+            if c: self._remove_contact(c)
+            self.relations.remove_contact(record["id"])
+        elif op == "group_add":
+            g = Group(**record["group"])
+            old = self._group_by_id.get(g.group_id)
+            if old: self._remove_group(old)
+            self._insert_group(g)
+        elif op == "group_update":
+            g = self._group_by_id.get(record["id"])
+            if g: self._set_group_fields(g, record["fields"])
+        elif op == "group_delete":
+            g = self._group_by_id.get(record["id"])
+            if g: self._remove_group(g)
+            self.relations.remove_group(record["id"])
+        elif op == "relation_add":
+            self.relations.add(record["contact_id"], record["group_id"])
+        elif op == "relation_remove":
+            self.relations.remove(record["contact_id"], record["group_id"])
+
+    def _contact_record(self, c):
+        return {"contact_id": c.contact_id, "full_name": c.full_name, "phone_number": c.phone_number,
+                "email": c.email, "address": c.address, "note": c.note,
+                "is_favorite": c.is_favorite, "created_at": c.created_at}
 
     # --- VALIDATION HELPER ---
     def is_valid_email(self, email):
         if not email: return True
-        pattern = r"^[\w\.-]+@[\w\.-]+\.\w+$"
-        return re.match(pattern, email) is not None
+        return EMAIL_PATTERN.match(email) is not None
 
     # --- CONTACT FEATURES ---
+    @_reads
+    @_cached
     def get_all_contacts(self, sort_by='id'):
-        data = self.contacts[:]
-        
-        # Helper to get the last name for sorting (e.g. "Nguyen Van A" -> "a")
-        def get_name_key(contact):
-            if not contact.full_name: return ""
-            return contact.full_name.strip().split(" ")[-1].lower()
-
-        if sort_by == 'name_asc':
-            data.sort(key=get_name_key)
-        elif sort_by == 'name_desc':
-            data.sort(key=get_name_key, reverse=True)
-        else:
-            data.sort(key=lambda x: x.contact_id)
-        return data
+        kind, reverse = SORT_MODES.get(sort_by, SORT_MODES["id"])
+        by_id = self._contact_by_id
+        return [by_id[i] for _, i in self._get_order(kind).iterate(reverse)]
+
+    @_reads
+    def get_contacts_page(self, sort_by='id', offset=0, limit=CONTACT_PAGE_SIZE):
+        # -> (contacts on this page, total number of contacts)
+        kind, reverse = SORT_MODES.get(sort_by, SORT_MODES["id"])
+        order = self._get_order(kind)
+        pairs = islice(order.iterate(reverse, offset=max(offset, 0)), limit)
+        return [self._contact_by_id[i] for _, i in pairs], len(order)
 
+    @_reads
+    def get_contacts_after(self, sort_by='id', cursor=None, limit=CONTACT_PAGE_SIZE):
+        # Keyset paging: -> (contacts, cursor for the next call or None at the end).
+        # Stays correct while contacts are added or deleted between calls.
+        kind, reverse = SORT_MODES.get(sort_by, SORT_MODES["id"])
+        pairs = list(islice(self._get_order(kind).iterate(reverse, after=cursor), limit))
+        next_cursor = pairs[-1] if pairs and len(pairs) == limit else None
+        return [self._contact_by_id[i] for _, i in pairs], next_cursor
+
+    @_reads
     def get_contact_by_id(self, c_id):
-        for c in self.contacts:
-            if c.contact_id == c_id: return c
-        return None
+        return self._contact_by_id.get(c_id)
+
+    @_reads
+    def get_contact_by_phone(self, phone):
+        # Any spelling of the number works: "+84 912 345 678" finds "0912345678".
+        # Of several contacts with the number, the oldest (smallest id)
+        return self._contact_by_phone.get(canonical_phone(phone))
 
+    @_changes
     def add_contact(self, full_name, phone, email, address, note):
         if not phone: return False, "Error: Phone number is required."
-        for c in self.contacts:
-            if c.phone_number == phone:
-                return False, "Error: Phone number already exists."
+        if canonical_phone(phone) in self._contact_by_phone:
+            return False, "Error: Phone number already exists."
         
         if not self.is_valid_email(email):
             return False, "Error: Invalid email format."
 
-        new_id = 1 if not self.contacts else max(c.contact_id for c in self.contacts) + 1
-        self.contacts.append(Contact(new_id, full_name, phone, email, address, note))
-        self.save_system_data()
+        c = Contact(self._next_contact_id, full_name, phone, email, address, note)
+        self._insert_contact(c)
+        self._commit({"op": "contact_add", "contact": self._contact_record(c)})
         return True, "Success: Contact added."
 
+    @_changes
     def update_contact(self, c_id, name, phone, email, address, note):
         c = self.get_contact_by_id(c_id)
         if not c: return False, "Error: Contact not found."
         
-        if phone and phone != c.phone_number:
-            for existing in self.contacts:
-                if existing.phone_number == phone:
-                    return False, "Error: New phone number is already taken."
+        # Another spelling of its own number is not a change (others may share it)
+        phone_key = canonical_phone(phone)
+        if phone and phone_key != canonical_phone(c.phone_number) and phone_key in self._contact_by_phone:
+            return False, "Error: New phone number is already taken."
         
         if email and not self.is_valid_email(email):
             return False, "Error: Invalid email format."
 
-        if name: c.full_name = name
-        if phone: c.phone_number = phone
-        if email: c.email = email
-        if address: c.address = address
-        if note: c.note = note
-        self.save_system_data()
+        fields = {}
+        if name: fields["full_name"] = name
+        if phone: fields["phone_number"] = phone
+        if email: fields["email"] = email
+        if address: fields["address"] = address
+        if note: fields["note"] = note
+        self._set_contact_fields(c, fields)
+        self._commit({"op": "contact_update", "id": c_id, "fields": fields})
         return True, "Success: Contact updated."
 
+    @_changes
     def delete_contact(self, c_id):
         c = self.get_contact_by_id(c_id)
         if c:
-            self.contacts.remove(c)
-            self.relations = [r for r in self.relations if r[0] != c_id]
-            self.save_system_data()
+            self._remove_contact(c)
+            self.relations.remove_contact(c_id)
+            self._commit({"op": "contact_delete", "id": c_id})
             return True
         return False
 
+    @_changes
     def toggle_favorite(self, c_id):
         c = self.get_contact_by_id(c_id)
         if c:
-            c.is_favorite = not c.is_favorite
-            self.save_system_data()
+            fields = {"is_favorite": not c.is_favorite}
+            self._set_contact_fields(c, fields)
+            self._commit({"op": "contact_update", "id": c_id, "fields": fields})
             return True, "Success: Favorite status updated."
         return False, "Error: Contact not found."
 
-    def search_contact(self, keyword):
-        kw = keyword.lower()
-        return [c for c in self.contacts if kw in c.full_name.lower() or kw in c.phone_number or kw in c.email.lower()]
+    @_reads
+    @_cached
+    def search_contact(self, keyword, limit=None):
+        # Matches in id order; `limit` stops after the first `limit` of them.
+        # Case, diacritics ("nguyen" finds "Nguyễn") and phone separators are ignored.
+        index = self._get_search_index()
+        ids = index.search(query_key(keyword), limit)
+        if self.stats is not None: self.stats.observe("search_contact.rows_scanned", index.last_scanned)
+        if limit is None: ids = sorted(ids)
+        return [self._contact_by_id[i] for i in ids]
+
+    # --- SNAPSHOT VIEWS ---
+    @_reads
+    def snapshot_view(self):
+        # Immutable view of the data as of now (views.PhoneBookView). It can be read
+        # from any thread without locks; the same view is returned until a change.
+        view = self._view
+        if view is not None and view.version == self._version: return view
+        with self._build_lock:
+            view = self._view
+            if view is not None and view.version == self._version: return view
+            view = build_view(self._version, self._contact_by_id, self.groups, self.relations, view,
+                              self._changed_chunks, self._groups_changed, self.relations.changed_groups)
+            self._changed_chunks = set()
+            self._groups_changed = False
+            self.relations.changed_groups.clear()
+            self._view = view
+            return view
+
+    # --- QUERIES ---
+    def query(self):
+        # Filters combined with AND, e.g.
+        # service.query().favorites().in_group(3).matching("tran").order_by("created_desc").limit(20).all()
+        return Query(self)
+
+    @_reads
+    def run_query(self, q):
+        kind, reverse = SORT_MODES.get(q.sort_by, SORT_MODES["id"])
+        return execute(self, plan_query(self, q, kind, reverse))
+
+    @_reads
+    def explain_query(self, q):
+        # -> the plan run_query() would use, e.g. "group 3 (120 rows) -> check favorite -> sort by created"
+        kind, reverse = SORT_MODES.get(q.sort_by, SORT_MODES["id"])
+        return str(plan_query(self, q, kind, reverse))
+
+    # --- DUPLICATES ---
+    @_reads
+    def find_duplicates(self):
+        # -> clusters (lists of contacts, oldest first) sharing a phone number or email
+        by_id = self._contact_by_id
+        return [[by_id[i] for i in cluster] for cluster in find_clusters(self.contacts)]
+
+    @_changes
+    def merge_contacts(self, keep_id, other_ids):
+        keep = self._contact_by_id.get(keep_id)
+        others = [self._contact_by_id[i] for i in dict.fromkeys(other_ids) if i != keep_id and i in self._contact_by_id]
+        if not keep: return False, "Error: Contact not found."
+        if not others: return False, "Error: Nothing to merge."
+        records, phones = self._merge(keep, others)
+        self._drop_unindexed_contacts()
+        self._commit(*records)
+        msg = f"Success: Merged {len(others)} contacts into #{keep_id}."
+        if phones: msg += f" Kept {phones} other phone numbers in its note."
+        return True, msg
+
+    @_changes
+    def merge_duplicates(self):
+        # Merge every duplicate cluster into its oldest contact, persisted as one batch
+        clusters = find_clusters(self.contacts)
+        # Rebuilding the orderings later is cheaper than deleting from them one by one
+        if clusters: self._orders = {}
+        records = []
+        merged = phones = 0
+        by_id = self._contact_by_id
+        for cluster in clusters:
+            cluster_records, cluster_phones = self._merge(by_id[cluster[0]], [by_id[i] for i in cluster[1:]])
+            records += cluster_records
+            merged += len(cluster) - 1
+            phones += cluster_phones
+        self._drop_unindexed_contacts()
+        self._commit(*records)
+        msg = f"Success: Merged {merged} duplicate contacts."
+        if phones: msg += f" Kept {phones} other phone numbers in notes."
+        return True, msg
+
+    def _drop_unindexed_contacts(self):
+        by_id = self._contact_by_id
+        self.contacts[:] = [c for c in self.contacts if by_id.get(c.contact_id) is c]
+
+    def _merge(self, keep, others):
+        # Fill keep's empty fields from the others, move their groups to keep and
+        # unindex them (the caller drops them from the list); -> (the mutation
+        # records, how many other phone numbers went into keep's note)
+        records = []
+        fields = {}
+        for attr in ("full_name", "email", "address", "note"):
+            if getattr(keep, attr): continue
+            value = next((getattr(o, attr) for o in others if getattr(o, attr)), "")
+            if value: fields[attr] = value
+        # Contacts matched by email alone have a number of their own: keep it in the note
+        keep_key = canonical_phone(keep.phone_number)
+        numbers = {}
+        for o in others:
+            key = canonical_phone(o.phone_number)
+            if key != keep_key: numbers.setdefault(key, o.phone_number)
+        note = fields.get("note", keep.note)
+        numbers = [n for n in numbers.values() if n not in note]
+        if numbers: fields["note"] = (note + "; " if note else "") + "Other phones: " + ", ".join(numbers)
+        if not keep.is_favorite and any(o.is_favorite for o in others): fields["is_favorite"] = True
+        if fields:
+            self._set_contact_fields(keep, fields)
+            records.append({"op": "contact_update", "id": keep.contact_id, "fields": fields})
+        for o in others:
+            for g_id in sorted(self.relations.groups_of(o.contact_id)):
+                if self.relations.add(keep.contact_id, g_id):
+                    records.append({"op": "relation_add", "contact_id": keep.contact_id, "group_id": g_id})
+            self._unindex_contact(o)
+            self.relations.remove_contact(o.contact_id)
+            records.append({"op": "contact_delete", "id": o.contact_id})
+        return records, len(numbers)
 
     # --- GROUP FEATURES ---
+    @_reads
     def get_all_groups(self):
-        return self.groups
+        return list(self.groups)
 
+    @_reads
     def get_group_by_id(self, g_id):
-        for g in self.groups:
-            if g.group_id == g_id: return g
-        return None
+        return self._group_by_id.get(g_id)
 
+    @_changes
     def create_group(self, name, desc):
         if not name: return False, "Error: Group name is required."
-        for g in self.groups:
-            if g.group_name.lower() == name.lower():
-                return False, "Error: Group name already exists."
-        new_id = 1 if not self.groups else max(g.group_id for g in self.groups) + 1
-        self.groups.append(Group(new_id, name, desc))
-        self.save_system_data()
+        if name.lower() in self._group_by_name:
+            return False, "Error: Group name already exists."
+        g = Group(self._next_group_id, name, desc)
+        self._insert_group(g)
+        self._commit({"op": "group_add", "group": {"group_id": g.group_id, "group_name": g.group_name, "description": g.description}})
         return True, "Success: Group created."
 
+    @_changes
     def update_group(self, g_id, new_name, new_desc):
         g = self.get_group_by_id(g_id)
         if not g: return False, "Error: Group not found."
         
+        fields = {}
         if new_name and new_name.lower() != g.group_name.lower():
-            for existing in self.groups:
-                if existing.group_name.lower() == new_name.lower():
-                    return False, "Error: Group name already exists."
-            g.group_name = new_name
+            if new_name.lower() in self._group_by_name:
+                return False, "Error: Group name already exists."
+            fields["group_name"] = new_name
             
-        if new_desc: g.description = new_desc
-        self.save_system_data()
+        if new_desc: fields["description"] = new_desc
+        self._set_group_fields(g, fields)
+        self._commit({"op": "group_update", "id": g_id, "fields": {"group_name": g.group_name, "description": g.description}})
         return True, "Success: Group updated."
 
+    @_changes
     def delete_group(self, g_id):
         g = self.get_group_by_id(g_id)
         if g:
-            self.groups.remove(g)
-            self.relations = [r for r in self.relations if r[1] != g_id]
-            self.save_system_data()
+            self._remove_group(g)
+            self.relations.remove_group(g_id)
+            self._commit({"op": "group_delete", "id": g_id})
             return True, "Success: Group deleted."
         return False, "Error: Group not found."
 
     # --- RELATIONSHIP FEATURES ---
+    @_reads
     def get_groups_of_contact(self, c_id):
-        group_ids = [r[1] for r in self.relations if r[0] == c_id]
-        return [g for g in self.groups if g.group_id in group_ids]
+        group_ids = sorted(self.relations.groups_of(c_id))
+        return [self._group_by_id[g] for g in group_ids if g in self._group_by_id]
+
+    @_reads
+    @_cached
+    def get_contacts_in_group(self, g_id, limit=None):
+        # Members in id order; `limit` keeps only the first `limit` of them
+        contact_ids = self.relations.contacts_of(g_id)
+        contact_ids = sorted(contact_ids) if limit is None else nsmallest(limit, contact_ids)
+        return [self._contact_by_id[c] for c in contact_ids if c in self._contact_by_id]
 
-    def get_contacts_in_group(self, g_id):
-        contact_ids = [r[0] for r in self.relations if r[1] == g_id]
-        return [c for c in self.contacts if c.contact_id in contact_ids]
+    @_reads
+    def get_group_member_count(self, g_id):
+        return self.relations.member_count(g_id)
 
+    @_changes
     def assign_contact_to_group(self, c_id, g_id):
-        if (c_id, g_id) not in self.relations:
-            self.relations.append((c_id, g_id))
-            self.save_system_data()
+        if self.relations.add(c_id, g_id):
+            self._commit({"op": "relation_add", "contact_id": c_id, "group_id": g_id})
             return True, "Success: Assigned to group."
         return False, "Error: Already in this group."
 
+    @_changes
     def remove_contact_from_group(self, c_id, g_id):
-        if (c_id, g_id) in self.relations:
-            self.relations.remove((c_id, g_id))
-            self.save_system_data()
+        if self.relations.remove(c_id, g_id):
+            self._commit({"op": "relation_remove", "contact_id": c_id, "group_id": g_id})
             return True, "Success: Removed from group."
         return False, "Error: Relation not found."
 
     # --- IMPORT / EXPORT ---
-    def export_contacts_to_file(self, file_path):
+    @_reads
+    def export_contacts_to_file(self, file_path, fmt=None, compress=None,
+                                favorites_only=False, group_id=None, created_from=None, created_to=None):
+        # Format and gzip compression default from the extension, e.g. "backup.csv.gz".
+        # created_from/created_to are inclusive prefixes of "YYYY-MM-DD HH:MM:SS".
+        base = file_path[:-3] if file_path.endswith(".gz") else file_path
+        if compress is None: compress = base != file_path
+        if fmt is None:
+            ext = os.path.splitext(base)[1].lstrip(".").lower()
+            fmt = ext if ext in EXPORT_FORMATS else "txt"
+        if fmt not in EXPORT_FORMATS:
+            return False, f"Error: Unknown export format '{fmt}'."
         try:
-            with open(file_path, "w", encoding="utf-8") as f:
-                f.write("ID|FullName|Phone|Email|Address|Note|Favorite|CreatedAt\n")
-                for c in self.contacts:
-                    f.write(f"{c.contact_id}|{c.full_name}|{c.phone_number}|{c.email}|{c.address}|{c.note}|{c.is_favorite}|{c.created_at}\n")
-            return True, f"Success: Exported {len(self.contacts)} contacts."
+            counter = [0]
+            contacts = self._iter_export_contacts(favorites_only, group_id, created_from, created_to, counter)
+            if compress:
+                f = gzip.open(file_path, "wt", encoding="utf-8", newline="", compresslevel=6)
+            else:
+                f = open(file_path, "w", encoding="utf-8", newline="")
+            with f:
+                for chunk in self._export_chunks(contacts, fmt):
+                    f.write(chunk)
+            return True, f"Success: Exported {counter[0]} contacts."
         except Exception as e:
             return False, f"Error: {str(e)}"
 
-    def import_contacts_from_file(self, file_path):
+    def _iter_export_contacts(self, favorites_only, group_id, created_from, created_to, counter):
+        if group_id is not None:
+            contacts = (self._contact_by_id[i] for i in sorted(self.relations.contacts_of(group_id))
+                        if i in self._contact_by_id)
+        else:
+            contacts = iter(self.contacts)
+        for c in contacts:
+            if favorites_only and not c.is_favorite: continue
+            if created_from and c.created_at[:len(created_from)] < created_from: continue
+            if created_to and c.created_at[:len(created_to)] > created_to: continue
+            counter[0] += 1
+            yield c
+
+    def _export_chunks(self, contacts, fmt):
+        if fmt == "csv":
+            buf = io.StringIO()
+            writer = csv.writer(buf, lineterminator="\n")
+            writer.writerow(EXPORT_COLUMNS)
+            n = 0
+            for c in contacts:
+                writer.writerow((c.contact_id, c.full_name, c.phone_number, c.email, c.address, c.note, c.is_favorite, c.created_at))
+                n += 1
+                if n % EXPORT_CHUNK_ROWS == 0:
+                    yield buf.getvalue()
+                    buf.seek(0); buf.truncate()
+            yield buf.getvalue()
+            return
+
+        if fmt == "jsonl":
+            to_line = lambda c: json.dumps(self._contact_record(c), ensure_ascii=False) + "\n"
+        else:
+            yield "|".join(EXPORT_COLUMNS) + "\n"
+            to_line = lambda c: f"{c.contact_id}|{c.full_name}|{c.phone_number}|{c.email}|{c.address}|{c.note}|{c.is_favorite}|{c.created_at}\n"
+        lines = []
+        for c in contacts:
+            lines.append(to_line(c))
+            if len(lines) >= EXPORT_CHUNK_ROWS:
+                yield "".join(lines)
+                lines.clear()
+        if lines: yield "".join(lines)
+
+    @_writes
+    def import_contacts_from_file(self, file_path, batch_size=IMPORT_BATCH_SIZE, commit_every=None, progress=None,
+                                  workers=None):
+        # Streams the file and persists once at the end (or every `commit_every` imported rows).
+        # `progress(rows_read, rows_per_sec)` is called after each batch.
+        # `workers`: processes parsing the file in parallel; None uses every core for
+        # files of PARALLEL_IMPORT_MIN_BYTES or more, 1 parses here. Same result either way.
         if not os.path.exists(file_path):
             return False, "Error: File not found."
-        
-        count = 0
-        skipped = 0
+        if workers is None:
+            workers = (os.cpu_count() or 1) if os.path.getsize(file_path) >= PARALLEL_IMPORT_MIN_BYTES else 1
+
+        stats = {"imported": 0, "skipped": 0, "invalid": 0}
+        rows = 0
+        pending = 0
+        started = time.perf_counter()
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                lines = f.readlines()
-                if lines and "ID|" in lines[0]:
-                    lines = lines[1:]
-                
-                for line in lines:
-                    p = line.strip().split("|")
-                    if len(p) < 3: continue
-                    
-                    phone = p[2]
-                    is_dup = False
-                    for c in self.contacts:
-                        if c.phone_number == phone:
-                            is_dup = True; break
-                    
-                    if is_dup:
-                        skipped += 1
-                    else:
-                        self.add_contact(p[1], p[2], p[3] if len(p)>3 else "", "", "")
-                        count += 1
-            return True, f"Success: Imported {count} contacts. Skipped {skipped} duplicates."
+            if workers > 1: batches = _parallel_import_batches(file_path, workers)
+            else: batches = _read_import_batches(file_path, batch_size)
+            for n_rows, valid, invalid in batches:
+                rows += n_rows
+                stats["invalid"] += invalid
+                pending += self._add_imported(valid, stats)
+                if commit_every and pending >= commit_every:
+                    self.save_system_data(); pending = 0
+                if progress: progress(rows, rows / max(time.perf_counter() - started, 1e-9))
+            if pending: self.save_system_data()
+            rate = rows / max(time.perf_counter() - started, 1e-9)
+            msg = f"Success: Imported {stats['imported']} contacts. Skipped {stats['skipped']} duplicates."
+            if stats["invalid"]: msg += f" Rejected {stats['invalid']} invalid rows."
+            return True, msg + f" ({rate:.0f} rows/s)"
         except Exception as e:
-            return False, f"Error: {str(e)}"
\ No newline at end of file
+            if pending: self.save_system_data()
+            return False, f"Error: {str(e)}"
+
+    def _add_imported(self, parsed, stats):
+        # Drop numbers we already have, then give the survivors one block of ids
+        valid = []
+        seen = set()
+        for name, phone, email, phone_key in parsed:
+            if phone_key in self._contact_by_phone or phone_key in seen:
+                stats["skipped"] += 1
+                continue
+            seen.add(phone_key)
+            valid.append((name, phone, email))
+
+        first_id = self._next_contact_id
+        self._next_contact_id += len(valid)
+        created_at = now_timestamp()
+        for offset, (name, phone, email) in enumerate(valid):
+            self._insert_contact(Contact(first_id + offset, name, phone, email, "", "", False, created_at))
+        if valid:
+            self._dirty.add(CONTACTS)
+            self._version += 1
+        stats["imported"] += len(valid)
+        return len(valid)
@@ -0,0 +1,306 @@
+# snapshot.py
+# Binary snapshot of the three text files, used for fast startup.
+#
+# Layout (little-endian):
+#   header   magic, version, record counts, section offsets and the size/mtime of
+#            each text file the snapshot was made from (to detect stale sections)
+#   contacts ids[q] created[q] favorite[B] then one string column per field, and
+#            one of canonical phone numbers (the lookup key)
+#   groups   ids[q] then the name and description columns
+#   relations contact ids[q] group ids[q]
+# A string column is: UTF-8 byte lengths[I] (one per record), blob size (Q), blob.
+# Each column decodes on its own (one decode() plus slicing for ASCII text) and a
+# single field can be read from its byte offset, so a reader only touches what it needs.
+# Saves do not rewrite the snapshot: invalidate_sections() marks the sections whose
+# files they rewrote, and the next load parses only those files and writes a new one.
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+
+from models import Contact, Group, canonical_phone
+
+MAGIC = b"PBSNAP"
+VERSION = 2
+HEADER = struct.Struct("<6sH3Q3Q6q")
+BLOB_SIZE = struct.Struct("<Q")
+CONTACT_COLUMNS = ("full_name", "phone_number", "email", "address", "note", "created_raw")
+# Derived columns stored after the fields, for answering lookups without the service
+KEY_COLUMNS = ("phone_key",)
+# contacts_at(): up to this many rows are read one field at a time
+FIELD_READ_ROWS = 8
+# created value that is not a standard timestamp: the text is in created_raw
+RAW_CREATED = -(2 ** 63)
+# Signature of an invalidated section, never the one of a file
+STALE_SIGNATURE = (-2, 0)
+
+
+def file_signature(paths):
+    sig = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            sig += [st.st_size, st.st_mtime_ns]
+        except OSError:
+            sig += [-1, 0]
+    return sig
+
+
+def _int_bytes(values):
+    a = array("q", values)
+    if sys.byteorder == "big": a.byteswap()
+    return a.tobytes()
+
+
+def _string_column(values):
+    encoded = [v.encode("utf-8") for v in values]
+    lengths = array("I", map(len, encoded))
+    if sys.byteorder == "big": lengths.byteswap()
+    blob = b"".join(encoded)
+    return lengths.tobytes() + BLOB_SIZE.pack(len(blob)) + blob
+
+
+def _contact_section(contacts):
+    created = [c._created for c in contacts]
+    parts = [_int_bytes(c.contact_id for c in contacts),
+             _int_bytes(RAW_CREATED if ts.__class__ is str else ts for ts in created),
+             bytes(c.is_favorite for c in contacts)]
+    for name in CONTACT_COLUMNS[:-1]:
+        parts.append(_string_column([getattr(c, name) for c in contacts]))
+    parts.append(_string_column([ts if ts.__class__ is str else "" for ts in created]))
+    parts.append(_string_column([canonical_phone(c.phone_number) for c in contacts]))
+    return b"".join(parts)
+
+
+def _previous_contact_section(path, contact_file):
+    # Contact section of the existing snapshot, if it was made from the current contacts file
+    try:
+        with SnapshotReader(path) as reader:
+            if reader.signature[:2] != file_signature([contact_file]): return None
+            return reader.contact_section()
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def write_snapshot(path, contacts, groups, relations, source_paths, contacts_unchanged=False):
+    # contacts_unchanged: the contacts file was not rewritten since the last snapshot,
+    # so its contact section (most of the file) can be copied instead of re-encoded
+    contacts = list(contacts); groups = list(groups); relations = list(relations)
+    contact_section = _previous_contact_section(path, source_paths[0]) if contacts_unchanged else None
+    if contact_section is None: contact_section = _contact_section(contacts)
+
+    group_section = b"".join([_int_bytes(g.group_id for g in groups),
+                              _string_column([g.group_name for g in groups]),
+                              _string_column([g.description for g in groups])])
+    relation_section = _int_bytes(r[0] for r in relations) + _int_bytes(r[1] for r in relations)
+
+    off_contacts = HEADER.size
+    off_groups = off_contacts + len(contact_section)
+    off_relations = off_groups + len(group_section)
+    header = HEADER.pack(MAGIC, VERSION, len(contacts), len(groups), len(relations),
+                         off_contacts, off_groups, off_relations, *file_signature(source_paths))
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(header); f.write(contact_section); f.write(group_section); f.write(relation_section)
+    os.replace(tmp, path)
+    return HEADER.size + len(contact_section) + len(group_section) + len(relation_section)
+
+
+def invalidate_sections(path, sections):
+    # Mark sections (0 contacts, 1 groups, 2 relations) stale by overwriting their
+    # file signatures in the header: a few bytes instead of the whole snapshot
+    try:
+        with open(path, "r+b") as f:
+            fields = list(HEADER.unpack(f.read(HEADER.size)))
+            if fields[0] != MAGIC or fields[1] != VERSION: return
+            for i in sections: fields[8 + 2 * i:10 + 2 * i] = STALE_SIGNATURE
+            f.seek(0)
+            f.write(HEADER.pack(*fields))
+    except (OSError, struct.error):
+        # Missing or too short: there is nothing a load would trust
+        pass
+
+
+class SnapshotReader:
+    # Decodes columns on demand from a memory-mapped snapshot file.
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        try:
+            self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file cannot be mapped
+            self._file.close()
+            raise ValueError("empty snapshot")
+        fields = HEADER.unpack_from(self._buf, 0)
+        if fields[0] != MAGIC or fields[1] != VERSION:
+            self.close()
+            raise ValueError("not a phonebook snapshot")
+        self.n_contacts, self.n_groups, self.n_relations = fields[2:5]
+        self._offsets = fields[5:8]
+        self.signature = list(fields[8:])
+        self._columns = None
+        # column name -> end offset of every value in its blob
+        self._ends = {}
+
+    def close(self):
+        self._buf.close(); self._file.close()
+
+    def current_sections(self, source_paths):
+        # -> per section, whether its text file is still the one the snapshot was made from
+        sig = file_signature(source_paths)
+        return [self.signature[i:i + 2] == sig[i:i + 2] for i in range(0, len(sig), 2)]
+
+    def contact_section(self):
+        return bytes(self._buf[self._offsets[0]:self._offsets[1]])
+
+    def __enter__(self): return self
+    def __exit__(self, *exc): self.close()
+
+    def _ints(self, offset, count):
+        a = array("q")
+        a.frombytes(self._buf[offset:offset + 8 * count])
+        if sys.byteorder == "big": a.byteswap()
+        return a, offset + 8 * count
+
+    def _lengths(self, offset, count):
+        lengths = array("I")
+        lengths.frombytes(self._buf[offset:offset + 4 * count])
+        if sys.byteorder == "big": lengths.byteswap()
+        return lengths
+
+    def _strings(self, offset, count, decode=True):
+        offset += 4 * count
+        (size,) = BLOB_SIZE.unpack_from(self._buf, offset)
+        blob_start = offset + BLOB_SIZE.size
+        if not decode: return None, blob_start + size
+        lengths = self._lengths(offset - 4 * count, count)
+        blob = self._buf[blob_start:blob_start + size]
+        text = blob.decode("utf-8")
+        # ASCII-only column: byte offsets are char offsets, slice the decoded text
+        src, decode_each = (text, False) if len(text) == size else (blob, True)
+        values, pos = [], 0
+        for n in lengths:
+            v = src[pos:pos + n]
+            values.append(v.decode("utf-8") if decode_each else v); pos += n
+        return values, blob_start + size
+
+    def _contact_layout(self):
+        # Offsets of every contact column, found by skipping over the blobs
+        if self._columns is None:
+            n = self.n_contacts
+            pos = self._offsets[0]
+            layout = {"contact_id": pos, "created": pos + 8 * n, "is_favorite": pos + 16 * n}
+            pos += 17 * n
+            for name in CONTACT_COLUMNS + KEY_COLUMNS:
+                layout[name] = pos
+                _, pos = self._strings(pos, n, decode=False)
+            self._columns = layout
+        return self._columns
+
+    def contact_column(self, name):
+        layout = self._contact_layout()
+        n = self.n_contacts
+        if name in ("contact_id", "created"):
+            return self._ints(layout[name], n)[0]
+        if name == "is_favorite":
+            return [b == 1 for b in self._buf[layout[name]:layout[name] + n]]
+        return self._strings(layout[name], n)[0]
+
+    def contact_at(self, i):
+        # Materialize a single record without decoding the other rows' text
+        layout = self._contact_layout()
+        values = [self._string_at(layout[name], i) for name in CONTACT_COLUMNS]
+        (c_id,) = struct.unpack_from("<q", self._buf, layout["contact_id"] + 8 * i)
+        (ts,) = struct.unpack_from("<q", self._buf, layout["created"] + 8 * i)
+        fav = self._buf[layout["is_favorite"] + i] == 1
+        return Contact(c_id, *values[:5], fav, values[5] if ts == RAW_CREATED else ts)
+
+    def _string_at(self, offset, i):
+        n = self.n_contacts
+        lengths = self._lengths(offset, n)
+        start = offset + 4 * n + BLOB_SIZE.size + sum(lengths[:i])
+        return self._buf[start:start + lengths[i]].decode("utf-8")
+
+    def contacts_at(self, rows):
+        # Records of the given rows; a few are read field by field, more decode whole columns
+        if len(rows) <= FIELD_READ_ROWS: return [self.contact_at(i) for i in rows]
+        ids = self.contact_column("contact_id")
+        created = self.contact_column("created")
+        favs = self.contact_column("is_favorite")
+        cols = [self.contact_column(name) for name in CONTACT_COLUMNS]
+        return [Contact(ids[i], *[col[i] for col in cols[:5]], favs[i],
+                        cols[5][i] if created[i] == RAW_CREATED else created[i]) for i in rows]
+
+    def find(self, name, text, whole=False):
+        # Rows whose string column `name` contains `text` (equals it with whole=True),
+        # found by searching the column's bytes without decoding them
+        layout = self._contact_layout()
+        n = self.n_contacts
+        needle = text.encode("utf-8")
+        if not needle: raise ValueError("empty search text")
+        start = layout[name] + 4 * n + BLOB_SIZE.size
+        (size,) = BLOB_SIZE.unpack_from(self._buf, start - BLOB_SIZE.size)
+        ends = self._ends.get(name)
+        if ends is None: ends = self._ends[name] = list(accumulate(self._lengths(layout[name], n)))
+        rows = []
+        pos = self._buf.find(needle, start, start + size)
+        while pos >= 0:
+            at = pos - start
+            i = bisect_right(ends, at)
+            row_start = ends[i - 1] if i else 0
+            if at + len(needle) <= ends[i] and (not whole or (at == row_start and at + len(needle) == ends[i])):
+                rows.append(i)
+                # Next match in the next row
+                pos = self._buf.find(needle, start + ends[i], start + size)
+            else:
+                pos = self._buf.find(needle, pos + 1, start + size)
+        return rows
+
+    def contacts(self):
+        ids = self.contact_column("contact_id")
+        created = self.contact_column("created")
+        favs = self.contact_column("is_favorite")
+        cols = [self.contact_column(name) for name in CONTACT_COLUMNS]
+        result = []
+        append = result.append
+        for c_id, ts, fav, name, phone, email, address, note, raw in zip(ids, created, favs, *cols):
+            append(Contact(c_id, name, phone, email, address, note, fav, raw if ts == RAW_CREATED else ts))
+        return result
+
+    def groups(self):
+        pos = self._offsets[1]
+        ids, pos = self._ints(pos, self.n_groups)
+        names, pos = self._strings(pos, self.n_groups)
+        descs, pos = self._strings(pos, self.n_groups)
+        return [Group(g_id, name, desc) for g_id, name, desc in zip(ids, names, descs)]
+
+    def relations(self):
+        c_ids, pos = self._ints(self._offsets[2], self.n_relations)
+        g_ids, _ = self._ints(pos, self.n_relations)
+        return list(zip(c_ids, g_ids))
+
+
+def open_current_snapshot(path, source_paths):
+    # A SnapshotReader for reading single contacts, or None when the contact section
+    # is missing, unreadable or older than the contacts file (source_paths[0])
+    try:
+        reader = SnapshotReader(path)
+    except (OSError, ValueError, struct.error):
+        return None
+    if reader.current_sections(source_paths[:1])[0]: return reader
+    reader.close()
+    return None
+
+
+def read_snapshot(path, source_paths):
+    # Returns [contacts, groups, relations] with None for each section whose text file
+    # changed since the snapshot was made, or None when the snapshot is missing or unreadable
+    try:
+        with SnapshotReader(path) as reader:
+            current = reader.current_sections(source_paths)
+            return [read() if ok else None for read, ok in zip((reader.contacts, reader.groups, reader.relations), current)]
+    except (OSError, ValueError, struct.error):
+        return None
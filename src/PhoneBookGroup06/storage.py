@@ -0,0 +1,504 @@
+# storage.py
+# Storage backends behind PhoneBookService. The service keeps the working set in
+# memory and hands every change to its backend as a mutation record, e.g.
+#   {"op": "contact_update", "id": 3, "fields": {"is_favorite": true}}
+# Replaying a record twice gives the same state, so backends may re-apply them.
+import contextlib
+import json
+import os
+import sqlite3
+
+from models import Contact, Group, name_sort_key, query_key, canonical_phone, search_fields
+from snapshot import read_snapshot, write_snapshot, open_current_snapshot, invalidate_sections
+from locking import FileLock
+
+# --- SYSTEM PATH CONFIG ---
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+
+CONTACT_FILE_NAME = "contacts.txt"
+GROUP_FILE_NAME = "groups.txt"
+RELATION_FILE_NAME = "contact_group.txt"
+JOURNAL_FILE_NAME = "journal.log"
+SNAPSHOT_FILE_NAME = "phonebook.snap"
+SQLITE_FILE_NAME = "phonebook.db"
+LOCK_FILE_NAME = "phonebook.lock"
+
+# Journal mode: fold the journal back into the snapshot after this many records
+JOURNAL_COMPACT_LIMIT = 1000
+# load_changes(): bytes before the last known end of a file that must be unchanged
+# for the file to count as appended to (and not rewritten)
+TAIL_CHECK_BYTES = 64
+
+# Parts of the data a save can write separately (one text file / table each)
+CONTACTS, GROUPS, RELATIONS = "contacts", "groups", "relations"
+ALL_SECTIONS = frozenset((CONTACTS, GROUPS, RELATIONS))
+# Deleting a contact or group also drops its memberships
+RECORD_SECTIONS = {"contact_add": {CONTACTS}, "contact_update": {CONTACTS}, "contact_delete": {CONTACTS, RELATIONS},
+                   "group_add": {GROUPS}, "group_update": {GROUPS}, "group_delete": {GROUPS, RELATIONS},
+                   "relation_add": {RELATIONS}, "relation_remove": {RELATIONS}}
+
+
+def _search_text(full_name, phone_number, email):
+    # search_fields() in one column; no query_key() contains the separator
+    return "\x1f".join(search_fields(full_name, phone_number, email))
+
+
+def touched_sections(records):
+    sections = set()
+    for record in records: sections |= RECORD_SECTIONS[record["op"]]
+    return sections
+
+
+class StorageBackend:
+    # True when apply() keeps records in a journal that load() hands back for replay
+    journaled = False
+
+    def load(self):
+        # -> (contacts, groups, relation pairs, records to replay on top)
+        raise NotImplementedError
+
+    def save(self, contacts, groups, relations, sections=ALL_SECTIONS):
+        # Persist the state of the given sections (the others did not change);
+        # -> bytes written when the backend knows it
+        raise NotImplementedError
+
+    def apply(self, records, state):
+        # Persist a batch of mutation records. `state` (the service) exposes
+        # contacts/groups/relations for backends that need a full save instead.
+        # -> bytes written when the backend knows it
+        raise NotImplementedError
+
+    def state_sections(self, records):
+        # Sections of `state` that apply(records, state) would read, so a caller
+        # writing from a copy of its data only copies those
+        return ALL_SECTIONS
+
+    def locked(self):
+        # Context manager held around load/save/apply so processes sharing the
+        # same data take turns
+        return contextlib.nullcontext()
+
+    def signature(self):
+        # Changes whenever any process commits new data; None = cannot tell
+        return None
+
+    def load_changes(self):
+        # Data other processes added since our last load/save:
+        # -> (contacts, groups, relation pairs, records to replay), or None when only
+        # a full load() can tell what changed
+        return None
+
+    def close(self):
+        pass
+
+
+def _stat_signature(paths):
+    # (size, mtime, inode) per file: saves replace files, so even a same-size
+    # rewrite within the mtime resolution gets a new inode
+    sig = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            sig.append((st.st_size, st.st_mtime_ns, st.st_ino))
+        except OSError:
+            sig.append(None)
+    return tuple(sig)
+
+
+def data_files(data_dir):
+    # The text files and the journal a TextFileBackend keeps in data_dir
+    return [os.path.join(data_dir, name) for name in (CONTACT_FILE_NAME, GROUP_FILE_NAME, RELATION_FILE_NAME, JOURNAL_FILE_NAME)]
+
+
+def data_signature(data_dir):
+    # Same as TextFileBackend.signature(), without creating the backend
+    return _stat_signature(data_files(data_dir))
+
+
+def open_snapshot(data_dir):
+    # snapshot.SnapshotReader over data_dir's snapshot when it holds exactly the data
+    # (made from the current text files, no journal records on top), else None.
+    # Reads only: nothing is created or locked
+    *text_files, journal_file = data_files(data_dir)
+    if os.path.exists(journal_file) and os.path.getsize(journal_file): return None
+    return open_current_snapshot(os.path.join(data_dir, SNAPSHOT_FILE_NAME), text_files)
+
+
+def _write_lines(path, lines):
+    # Write to a temporary file and rename it over `path`: a crash or a reader
+    # in another process never sees a half-written file
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.writelines(lines)
+    os.replace(tmp, path)
+
+
+def _parse_contacts(lines, out):
+    for line in lines:
+        p = line.strip().split("|")
+        if len(p) >= 3:
+            out.append(Contact(int(p[0]), p[1], p[2], p[3], p[4], p[5], p[6]=="True", p[7]))
+
+def _parse_groups(lines, out):
+    for line in lines:
+        p = line.strip().split("|")
+        if len(p) >= 2:
+            out.append(Group(int(p[0]), p[1], p[2] if len(p)>2 else ""))
+
+def _parse_relations(lines, out):
+    for line in lines:
+        p = line.strip().split("|")
+        if len(p) == 2:
+            out.append((int(p[0]), int(p[1])))
+
+
+# Section order of the text files and the snapshot: contacts, groups, relations
+TEXT_PARSERS = (_parse_contacts, _parse_groups, _parse_relations)
+
+
+class TextFileBackend(StorageBackend):
+    # The original pipe-delimited text files, plus the binary snapshot cache
+    # (snapshot.py) and the optional append-only journal.
+    def __init__(self, data_dir, use_journal=False, journal_limit=JOURNAL_COMPACT_LIMIT):
+        self.data_dir = data_dir
+        if not os.path.exists(data_dir):
+            os.makedirs(data_dir)
+        self.contact_file = os.path.join(data_dir, CONTACT_FILE_NAME)
+        self.group_file = os.path.join(data_dir, GROUP_FILE_NAME)
+        self.relation_file = os.path.join(data_dir, RELATION_FILE_NAME)
+        self.journal_file = os.path.join(data_dir, JOURNAL_FILE_NAME)
+        self.snapshot_file = os.path.join(data_dir, SNAPSHOT_FILE_NAME)
+        self.text_files = (self.contact_file, self.group_file, self.relation_file)
+        self.journaled = use_journal
+        self.journal_limit = journal_limit
+        self.journal_size = 0
+        # Sections changed by journal records that the text files do not have yet
+        self._unsaved = set()
+        # path -> (inode, mtime, bytes read or written so far, last bytes before that)
+        self._ends = {}
+        self.lock = FileLock(os.path.join(data_dir, LOCK_FILE_NAME))
+
+    def locked(self):
+        return self.lock
+
+    def signature(self):
+        return _stat_signature(self.text_files + (self.journal_file,))
+
+    # --- LOAD ---
+    def load(self):
+        # Sections of the snapshot whose text file changed are parsed from the text
+        sections = read_snapshot(self.snapshot_file, self.text_files) or [None, None, None]
+        stale = [i for i, section in enumerate(sections) if section is None]
+        for i in stale:
+            sections[i] = self._load_text_file(self.text_files[i], TEXT_PARSERS[i])
+        self._remember(self.text_files)
+        contacts, groups, relations = sections
+        # Next start can skip the text parsing
+        if stale and any(os.path.exists(p) for p in self.text_files):
+            self._write_snapshot(contacts, groups, relations, contacts_unchanged=0 not in stale)
+        return contacts, groups, relations, self._read_journal()
+
+    def _load_text_file(self, path, parse):
+        records = []
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                parse(f, records)
+        return records
+
+    # --- EXTERNAL CHANGES ---
+    def _remember(self, paths):
+        # Record how far we know each file, so load_changes() can read only what follows
+        for path in paths:
+            try:
+                with open(path, "rb") as f:
+                    st = os.fstat(f.fileno())
+                    f.seek(max(st.st_size - TAIL_CHECK_BYTES, 0))
+                    self._ends[path] = (st.st_ino, st.st_mtime_ns, st.st_size, f.read())
+            except OSError:
+                self._ends.pop(path, None)
+
+    def _appended(self, path):
+        # -> complete lines added to `path` since _remember() (b"" if none), or None if
+        # the file was rewritten, truncated, replaced or deleted
+        known = self._ends.get(path)
+        try:
+            f = open(path, "rb")
+        except OSError:
+            return b"" if known is None else None
+        with f:
+            st = os.fstat(f.fileno())
+            ino, mtime, end, tail = known or (st.st_ino, None, 0, b"")
+            if st.st_ino != ino or st.st_size < end: return None
+            if st.st_size == end: return b"" if st.st_mtime_ns == mtime else None
+            f.seek(end - len(tail))
+            if f.read(len(tail)) != tail: return None
+            data = f.read(st.st_size - end)
+        # A line still being written is left for the next call
+        data = data[:data.rfind(b"\n") + 1]
+        new_end = end + len(data)
+        self._ends[path] = (st.st_ino, st.st_mtime_ns if new_end == st.st_size else None, new_end,
+                            (tail + data)[-TAIL_CHECK_BYTES:])
+        return data
+
+    def load_changes(self):
+        # Lines appended to the text files or the journal by other programs
+        if not self._ends: return None
+        added = [self._appended(path) for path in self.text_files + (self.journal_file,)]
+        if None in added: return None
+        contacts, groups, relations = [], [], []
+        try:
+            _parse_contacts(added[0].decode("utf-8").split("\n"), contacts)
+            _parse_groups(added[1].decode("utf-8").split("\n"), groups)
+            _parse_relations(added[2].decode("utf-8").split("\n"), relations)
+            records = [json.loads(line) for line in added[3].split(b"\n") if line]
+        except (ValueError, IndexError):
+            # Lines the full parser would treat differently (e.g. a damaged journal)
+            return None
+        self.journal_size += len(records)
+        self._unsaved |= touched_sections(records)
+        return contacts, groups, relations, records
+
+    def _read_journal(self):
+        records = []
+        self.journal_size = 0
+        if not os.path.exists(self.journal_file):
+            self._ends.pop(self.journal_file, None)
+            return records
+        good_offset = 0
+        with open(self.journal_file, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"): raise ValueError("torn record")
+                    records.append(json.loads(line.decode("utf-8")))
+                except ValueError:
+                    break
+                good_offset += len(line)
+        self.journal_size = len(records)
+        self._unsaved = touched_sections(records)
+        # Drop a half-written tail so new records are not appended after garbage
+        if os.path.getsize(self.journal_file) != good_offset:
+            os.truncate(self.journal_file, good_offset)
+        self._remember((self.journal_file,))
+        return records
+
+    # --- SAVE ---
+    def save(self, contacts, groups, relations, sections=ALL_SECTIONS):
+        # Only the files of changed sections are rewritten (plus any the journal touched)
+        sections = self._unsaved | set(sections)
+        # Their snapshot sections go stale first (a crash in between costs only a parse);
+        # the next load rebuilds the snapshot from the files written here
+        invalidate_sections(self.snapshot_file, [i for i, name in enumerate((CONTACTS, GROUPS, RELATIONS)) if name in sections])
+        written = 0
+        if CONTACTS in sections:
+            _write_lines(self.contact_file, (f"{c.contact_id}|{c.full_name}|{c.phone_number}|{c.email}|{c.address}|{c.note}|{c.is_favorite}|{c.created_at}\n"
+                                             for c in contacts))
+            written += os.path.getsize(self.contact_file)
+        if GROUPS in sections:
+            _write_lines(self.group_file, (f"{g.group_id}|{g.group_name}|{g.description}\n" for g in groups))
+            written += os.path.getsize(self.group_file)
+        if RELATIONS in sections:
+            _write_lines(self.relation_file, (f"{r[0]}|{r[1]}\n" for r in relations))
+            written += os.path.getsize(self.relation_file)
+        # The text files now contain every journaled change
+        if os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
+        self.journal_size = 0
+        self._unsaved = set()
+        self._remember(self.text_files + (self.journal_file,))
+        return written
+
+    def _write_snapshot(self, contacts, groups, relations, contacts_unchanged=False):
+        try:
+            return write_snapshot(self.snapshot_file, contacts, groups, relations, self.text_files, contacts_unchanged)
+        except OSError:
+            # The snapshot is only a cache of the text files
+            if os.path.exists(self.snapshot_file): os.remove(self.snapshot_file)
+            return 0
+
+    def state_sections(self, records):
+        # A full save of the changed sections, unless the records only go to the journal
+        if self.journaled and self.journal_size + len(records) < self.journal_limit: return set()
+        return self._unsaved | touched_sections(records)
+
+    def apply(self, records, state):
+        if not self.journaled:
+            return self.save(state.contacts, state.groups, state.relations, touched_sections(records))
+        data = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode("utf-8")
+        with open(self.journal_file, "ab") as f:
+            f.write(data)
+        self._remember((self.journal_file,))
+        self.journal_size += len(records)
+        self._unsaved |= touched_sections(records)
+        if self.journal_size >= self.journal_limit:
+            return len(data) + self.save(state.contacts, state.groups, state.relations, ())
+        return len(data)
+
+
+class SqliteBackend(StorageBackend):
+    # Embedded sqlite3 database in WAL mode. Every batch of records is one
+    # transaction of row-level writes. Each row also stores its canonical phone
+    # (indexed) and search text, so the lookups below run inside the database.
+    CONTACT_COLUMNS = ("contact_id", "full_name", "phone_number", "email", "address", "note", "is_favorite", "created_at")
+    # Derived from the fields, kept up to date on every write
+    KEY_COLUMNS = ("name_key", "phone_key", "search_key")
+    UPDATABLE = {"contact": {"full_name", "phone_number", "email", "address", "note", "is_favorite"},
+                 "group": {"group_name", "description"}}
+
+    def __init__(self, path):
+        self.path = path
+        folder = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.lock = FileLock(path + ".lock")
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        # Only for filling the key columns of changed rows, never in a WHERE clause
+        self.conn.create_function("py_phone", 1, lambda s: canonical_phone(s or ""), deterministic=True)
+        self.conn.create_function("py_search", 3, lambda *f: _search_text(*(v or "" for v in f)), deterministic=True)
+        self._insert_contact_sql = "INSERT OR REPLACE INTO contacts (" + ", ".join(self.CONTACT_COLUMNS + self.KEY_COLUMNS) + \
+                                   ") VALUES (" + ", ".join("?" * len(self.CONTACT_COLUMNS + self.KEY_COLUMNS)) + ")"
+        with self.conn:
+            # created_at has no declared type: it holds the int timestamp, or the
+            # original text when that was not in the standard format
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS contacts (
+                    contact_id INTEGER PRIMARY KEY, full_name TEXT, phone_number TEXT, email TEXT,
+                    address TEXT, note TEXT, is_favorite INTEGER, created_at, name_key TEXT,
+                    phone_key TEXT, search_key TEXT);
+                CREATE INDEX IF NOT EXISTS idx_contacts_name ON contacts(name_key, contact_id);
+                CREATE INDEX IF NOT EXISTS idx_contacts_created ON contacts(created_at, contact_id);
+                CREATE TABLE IF NOT EXISTS groups (
+                    group_id INTEGER PRIMARY KEY, group_name TEXT, description TEXT);
+                CREATE TABLE IF NOT EXISTS contact_group (
+                    contact_id INTEGER, group_id INTEGER, PRIMARY KEY (contact_id, group_id)) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS idx_contact_group_group ON contact_group(group_id, contact_id);
+            """)
+            # Databases made before the key columns existed get them filled once
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(contacts)")}
+            if "phone_key" not in columns:
+                self.conn.execute("ALTER TABLE contacts ADD COLUMN phone_key TEXT")
+                self.conn.execute("ALTER TABLE contacts ADD COLUMN search_key TEXT")
+                self.conn.execute("UPDATE contacts SET phone_key = py_phone(phone_number), "
+                                  "search_key = py_search(full_name, phone_number, email)")
+            self.conn.execute("DROP INDEX IF EXISTS idx_contacts_phone")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_contacts_phone_key ON contacts(phone_key, contact_id)")
+
+    def close(self):
+        self.conn.close()
+
+    def locked(self):
+        return self.lock
+
+    def signature(self):
+        # Bumped by SQLite whenever another connection commits
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def is_empty(self):
+        return self.conn.execute("SELECT NOT EXISTS (SELECT 1 FROM contacts) AND NOT EXISTS (SELECT 1 FROM groups)").fetchone()[0] == 1
+
+    # --- LOAD / SAVE ---
+    def load(self):
+        rows = self.conn.execute("SELECT " + ", ".join(self.CONTACT_COLUMNS) + " FROM contacts ORDER BY contact_id")
+        contacts = [self._contact(r) for r in rows]
+        groups = [Group(*r) for r in self.conn.execute("SELECT group_id, group_name, description FROM groups ORDER BY group_id")]
+        relations = self.conn.execute("SELECT contact_id, group_id FROM contact_group").fetchall()
+        return contacts, groups, relations, []
+
+    def save(self, contacts, groups, relations, sections=ALL_SECTIONS):
+        with self.conn:
+            if CONTACTS in sections:
+                self.conn.execute("DELETE FROM contacts")
+                self.conn.executemany(self._insert_contact_sql, map(self._contact_row, contacts))
+            if GROUPS in sections:
+                self.conn.execute("DELETE FROM groups")
+                self.conn.executemany("INSERT INTO groups VALUES (?, ?, ?)", ((g.group_id, g.group_name, g.description) for g in groups))
+            if RELATIONS in sections:
+                self.conn.execute("DELETE FROM contact_group")
+                self.conn.executemany("INSERT INTO contact_group VALUES (?, ?)", relations)
+
+    def state_sections(self, records):
+        # Rows are written from the records alone
+        return set()
+
+    def apply(self, records, state):
+        with self.conn:
+            for record in records:
+                self._apply_one(record)
+
+    def _apply_one(self, record):
+        op = record["op"]
+        ex = self.conn.execute
+        if op == "contact_add":
+            ex(self._insert_contact_sql, self._contact_row(Contact(**record["contact"])))
+        elif op == "contact_update":
+            fields = {k: v for k, v in record["fields"].items() if k in self.UPDATABLE["contact"]}
+            if "full_name" in fields: fields["name_key"] = name_sort_key(fields["full_name"])
+            if "is_favorite" in fields: fields["is_favorite"] = int(fields["is_favorite"])
+            if fields:
+                ex("UPDATE contacts SET " + ", ".join(f"{k} = ?" for k in fields) + " WHERE contact_id = ?",
+                   (*fields.values(), record["id"]))
+            # A partial update only knows some of the fields: the row has them all
+            if fields.keys() & {"full_name", "phone_number", "email"}:
+                ex("UPDATE contacts SET phone_key = py_phone(phone_number), search_key = py_search(full_name, phone_number, email) "
+                   "WHERE contact_id = ?", (record["id"],))
+        elif op == "contact_delete":
+            ex("DELETE FROM contacts WHERE contact_id = ?", (record["id"],))
+            ex("DELETE FROM contact_group WHERE contact_id = ?", (record["id"],))
+        elif op == "group_add":
+            g = record["group"]
+            ex("INSERT OR REPLACE INTO groups VALUES (?, ?, ?)", (g["group_id"], g["group_name"], g["description"]))
+        elif op == "group_update":
+            fields = {k: v for k, v in record["fields"].items() if k in self.UPDATABLE["group"]}
+            if fields:
+                ex("UPDATE groups SET " + ", ".join(f"{k} = ?" for k in fields) + " WHERE group_id = ?",
+                   (*fields.values(), record["id"]))
+        elif op == "group_delete":
+            ex("DELETE FROM groups WHERE group_id = ?", (record["id"],))
+            ex("DELETE FROM contact_group WHERE group_id = ?", (record["id"],))
+        elif op == "relation_add":
+            ex("INSERT OR IGNORE INTO contact_group VALUES (?, ?)", (record["contact_id"], record["group_id"]))
+        elif op == "relation_remove":
+            ex("DELETE FROM contact_group WHERE contact_id = ? AND group_id = ?", (record["contact_id"], record["group_id"]))
+
+    def _contact_row(self, c):
+        return (c.contact_id, c.full_name, c.phone_number, c.email, c.address, c.note,
+                int(c.is_favorite), c._created, name_sort_key(c.full_name), canonical_phone(c.phone_number),
+                _search_text(c.full_name, c.phone_number, c.email))
+
+    def _contact(self, row):
+        return Contact(row[0], row[1], row[2], row[3], row[4], row[5], bool(row[6]), row[7])
+
+    # --- QUERIES (no need to load the whole dataset) ---
+    def _select(self, where="", params=(), order="contact_id"):
+        sql = "SELECT " + ", ".join("c." + col for col in self.CONTACT_COLUMNS) + " FROM contacts c " + where + " ORDER BY " + order
+        return [self._contact(r) for r in self.conn.execute(sql, params)]
+
+    def get_contact(self, c_id):
+        found = self._select("WHERE c.contact_id = ?", (c_id,))
+        return found[0] if found else None
+
+    def find_contact_by_phone(self, phone):
+        # Any format of the number, like PhoneBookService.get_contact_by_phone()
+        found = self._select("WHERE c.phone_key = ?", (canonical_phone(phone),), "c.contact_id LIMIT 1")
+        return found[0] if found else None
+
+    def search_contacts(self, keyword):
+        # Same matches as PhoneBookService.search_contact(), in id order
+        return self._select("WHERE instr(c.search_key, ?)", (query_key(keyword),))
+
+
+def open_backend(kind, data_dir, use_journal=False):
+    # kind: "text" (default) or "sqlite". A new SQLite database starts as a copy
+    # of the text files found in data_dir.
+    text = TextFileBackend(data_dir, use_journal)
+    if kind != "sqlite":
+        return text
+    backend = SqliteBackend(os.path.join(data_dir, SQLITE_FILE_NAME))
+    with backend.locked(), text.locked():
+        if backend.is_empty() and any(os.path.exists(p) for p in text.text_files):
+            contacts, groups, relations, pending = text.load()
+            backend.save(contacts, groups, relations)
+            backend.apply(pending, None)
+    return backend
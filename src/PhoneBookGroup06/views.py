@@ -0,0 +1,105 @@
+# views.py
+# Immutable point-in-time views of the phone book. PhoneBookService.snapshot_view()
+# returns one; it never changes afterwards, so any thread can read it without
+# locks while the service keeps changing. A new view shares every part the
+# changes since the previous view did not touch: contacts are kept in chunks of
+# VIEW_CHUNK consecutive ids, groups and each group's member set separately.
+from collections import namedtuple
+from itertools import chain
+from bisect import bisect_left
+from types import MappingProxyType
+
+from models import Contact, Group
+
+VIEW_CHUNK = 1024
+
+
+class ContactRecord(namedtuple("ContactRecord", "contact_id full_name phone_number email address note is_favorite created_at")):
+    __slots__ = ()
+    __str__ = Contact.__str__
+
+
+class GroupRecord(namedtuple("GroupRecord", "group_id group_name description")):
+    __slots__ = ()
+    __str__ = Group.__str__
+
+
+def _contact_record(c):
+    return ContactRecord(c.contact_id, c.full_name, c.phone_number, c.email, c.address, c.note, c.is_favorite, c.created_at)
+
+
+def _chunk(ids, contact_by_id):
+    # -> (ids, records), both in id order
+    return tuple(ids), tuple(_contact_record(contact_by_id[i]) for i in ids)
+
+
+class PhoneBookView:
+    def __init__(self, version, chunks, groups, members):
+        self.version = version
+        # chunk number -> (ids, records)
+        self._chunks = MappingProxyType(chunks)
+        self._chunk_order = tuple(sorted(chunks))
+        self._size = sum(len(ids) for ids, _ in chunks.values())
+        self.groups = groups
+        self._group_by_id = MappingProxyType({g.group_id: g for g in groups})
+        # group id -> frozenset of contact ids
+        self._members = MappingProxyType(members)
+
+    def __len__(self):
+        return self._size
+
+    def contacts(self):
+        # All contacts in id order
+        return chain.from_iterable(self._chunks[k][1] for k in self._chunk_order)
+
+    def get_contact(self, c_id):
+        chunk = self._chunks.get(c_id // VIEW_CHUNK)
+        if chunk is None: return None
+        ids, records = chunk
+        i = bisect_left(ids, c_id)
+        return records[i] if i < len(ids) and ids[i] == c_id else None
+
+    def favorites(self):
+        return (c for c in self.contacts() if c.is_favorite)
+
+    def get_group(self, g_id):
+        return self._group_by_id.get(g_id)
+
+    def member_ids(self, g_id):
+        return self._members.get(g_id, frozenset())
+
+    def contacts_in_group(self, g_id):
+        found = map(self.get_contact, sorted(self.member_ids(g_id)))
+        return [c for c in found if c is not None]
+
+    def groups_of_contact(self, c_id):
+        return [g for g in self.groups if c_id in self._members.get(g.group_id, ())]
+
+
+def build_view(version, contact_by_id, groups, relations, previous=None,
+               changed_chunks=(), groups_changed=True, changed_groups=()):
+    # previous=None builds everything; otherwise only the changed parts are rebuilt
+    if previous is None:
+        ids_by_chunk = {}
+        for c_id in sorted(contact_by_id):
+            ids_by_chunk.setdefault(c_id // VIEW_CHUNK, []).append(c_id)
+        chunks = {k: _chunk(ids, contact_by_id) for k, ids in ids_by_chunk.items()}
+    else:
+        chunks = dict(previous._chunks)
+        for k in changed_chunks:
+            ids = [i for i in range(k * VIEW_CHUNK, (k + 1) * VIEW_CHUNK) if i in contact_by_id]
+            if ids: chunks[k] = _chunk(ids, contact_by_id)
+            else: chunks.pop(k, None)
+
+    if previous is None or groups_changed:
+        group_records = tuple(GroupRecord(g.group_id, g.group_name, g.description) for g in groups)
+    else:
+        group_records = previous.groups
+
+    old_members = {} if previous is None else previous._members
+    members = {}
+    for g in group_records:
+        g_id = g.group_id
+        if g_id in old_members and g_id not in changed_groups: members[g_id] = old_members[g_id]
+        else: members[g_id] = frozenset(relations.member_ids(g_id))
+    return PhoneBookView(version, chunks, group_records, members)